@@ -3,6 +3,7 @@ import datetime
 import inspect
 import os
 import pathlib
+import stat
 from typing import Optional
 
 from compyle.databases.mongo import MongoDB
@@ -42,6 +43,12 @@ def get_parser(subparser: argparse._SubParsersAction) -> argparse.ArgumentParser
         default=argparse.SUPPRESS,
         const=DEFAULT_REPORT_FOLDER,
     )
+    parser.add_argument(
+        "-f",
+        "--fast",
+        action="store_true",
+        help="insert the clips in the database without waiting for the write acknowledgement",
+    )
 
     # argparse.SUPPRESS if os.getenv("MONGO_DB_URI") else
     return parser
@@ -49,40 +56,51 @@ def get_parser(subparser: argparse._SubParsersAction) -> argparse.ArgumentParser
 
 # TODO > game_name et period des settings
 # pylint: disable=line-too-long
-def collect(*, output: Optional[pathlib.Path] = None, game_name: str = "League of Legends", period: int = 2):
+def collect(
+    *, output: Optional[pathlib.Path] = None, game_name: str = "League of Legends", period: int = 2, fast: bool = False
+):
     """Collects the clips for the specified game and period via the Twitch public API.
 
     Args:
         output (Optional[pathlib.Path], optional): the destination path where to store the clips data. Defaults to None. If None, the clips data will be stored in the mongoDB database.
         game_name (str, optional): the name of the game to retrieve the clips from. Defaults to "League of Legends".
         period (int, optional): the past period (in days) to retrieve the clips from. Defaults to 2.
+        fast (bool, optional): if True, the clips are inserted in the database with fire-and-forget writes. Defaults to False.
     """
     # initializes the Twitch API client
     twitch_api = TwitchAPI()
 
     # retrieves the clips for the specified game and period
-    game_name = "Minecraft"
     game_id = twitch_api.get_game_id(game_name)
     clips = twitch_api.get_game_clips(game_id, period=period)
 
     if not output:
         # stores the clips data to the database
         with MongoDB() as mongo_db:
-            mongo_db.insert_documents("clips", clips)
+            mongo_db.insert_documents("clips", clips, fast=fast)
     else:
-        output = output.__str__()
+        # probes the output path once, an existing file also proves that its parent folder exists
+        try:
+            mode: Optional[int] = os.stat(output).st_mode
+        except FileNotFoundError:
+            mode = None
+
         # stores the clips data in the filesystem
-        if output.endswith("/") or os.path.isdir(output):
-            output = os.path.join(output, game_name)
+        path = pathlib.PurePosixPath(output)
+        if str(output).endswith("/") or (mode is not None and stat.S_ISDIR(mode)):
+            folder = path / game_name
             filename = f'{datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}.json'
-        elif "/" in output:
-            output, filename = output.rsplit("/", maxsplit=1)
         else:
-            output, filename = "", output
+            folder, filename = path.parent, path.name
 
-        # creates the output folders that does not exist
-        if output:
-            os.makedirs(output, exist_ok=True)
+        # creates the output folders that does not exist, walking the parents only when one of them is missing
+        if folder != path.parent or (mode is None and folder.name):
+            try:
+                os.mkdir(folder)
+            except FileExistsError:
+                pass
+            except FileNotFoundError:
+                os.makedirs(folder, exist_ok=True)
 
         # serializes the clips data to the data file
-        serialize(os.path.join(output, filename), clips)
+        serialize(str(folder / filename), clips)
@@ -1,14 +1,21 @@
 # pylint: disable=invalid-name
 
+import heapq
 import logging
 import os
+import queue
+import subprocess  # nosec
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 from math import ceil
-from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, TypeAlias, Union
-from urllib.request import urlcleanup
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple, TypeAlias, Union
 
 import cv2
 import numpy as np
 from moviepy.audio.fx.audio_normalize import audio_normalize
+from moviepy.config import get_setting
 from moviepy.editor import (
     CompositeVideoClip,
     TextClip,
@@ -17,9 +24,10 @@ from moviepy.editor import (
 )
 from moviepy.video.compositing.transitions import crossfadein, crossfadeout, slide_in
 from moviepy.video.fx.resize import resize
+from numba import njit
 
 from compyle.databases.mongo import MongoDB
-from compyle.services.common import get_url_content
+from compyle.services.common import SESSION, cleanup_url_contents, get_url_content
 from compyle.settings import DEBUG
 from compyle.utils.decorators import call_before_after
 
@@ -32,109 +40,294 @@ vec3: TypeAlias = Tuple[int, int, int]
 vec4: TypeAlias = Tuple[int, int, int, int]
 
 
-def get_latest_file(path: os.PathLike) -> Optional[str]:
-    """Returns the most recent file that has been created in the specified folder path.
+# enables the SIMD code paths and lets the detection parallel loops use every core
+cv2.setUseOptimized(True)
+cv2.setNumThreads(os.cpu_count() or 1)
+
+# the models are resolved from the project root rather than from the working directory
+opencv_folder: str = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "opencv")
+cascade: str = os.path.join(opencv_folder, "haarcascades", "frontalface.xml")
+yunet: str = os.path.join(opencv_folder, "dnn", "face_detection_yunet.onnx")
+
+
+# the Haar classifiers, local to each thread since a detection stores its image pyramid inside the classifier
+classifiers = threading.local()
+
+
+def get_classifier() -> cv2.CascadeClassifier:
+    """Loads the Haar cascade classifier on first use in the calling thread, parsing the XML cascade once per thread.
+
+    Returns:
+        cv2.CascadeClassifier: the frontal face classifier of the calling thread.
+    """
+    if not hasattr(classifiers, "classifier"):
+        classifiers.classifier = cv2.CascadeClassifier(cascade)
+
+    return classifiers.classifier
+
+
+def load_detector(model: str) -> Optional[cv2.FaceDetectorYN]:
+    """Loads the YuNet face detector from the specified ONNX model, on the CUDA backend if a device is available.
 
     Args:
-        path (os.PathLike): the path to the directory.
+        model (str): the path to the ONNX model.
 
     Returns:
-        Optional[str]: the path to the most recent file if any, otherwise None.
+        Optional[cv2.FaceDetectorYN]: the detector if the model exists, otherwise None.
     """
-    # checks if the specified path is an existing directory
-    if path and os.path.isdir(path):
-        # gets the file in the specified path with the latest creation time
-        return max((os.path.join(path, basename) for basename in os.listdir(path)), key=os.path.getctime, default=None)
-    return None
+    if not os.path.isfile(model):
+        LOGGER.debug("DNN face detector unavailable, falling back to the Haar cascade classifier")
+        return None
+
+    # prefers the GPU and falls back to the OpenCV CPU backend which dispatches to the SIMD kernels
+    if cv2.cuda.getCudaEnabledDeviceCount() > 0:
+        backend, target = cv2.dnn.DNN_BACKEND_CUDA, cv2.dnn.DNN_TARGET_CUDA
+    else:
+        backend, target = cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU
+
+    return cv2.FaceDetectorYN.create(
+        model, "", (320, 320), score_threshold=0.6, backend_id=backend, target_id=target
+    )
+
+
+detector: Optional[cv2.FaceDetectorYN] = load_detector(yunet)
+
+# the detector holds its input size and buffers, its calls are serialized across the probing threads
+detector_lock = threading.Lock()
 
 
-cascade: str = "./opencv/haarcascades/frontalface.xml"
-classifier: cv2.CascadeClassifier = cv2.CascadeClassifier(cascade)
+# the scratch buffers of the face detection preprocessing, local to each thread since they are written in place
+scratch = threading.local()
 
 
-def get_faces(image: cv2.Mat, *, scale: float = 0.5) -> List[vec4]:
-    """Returns the faces detected in the specified image using the Haar cascade classifier.
+def get_scratch_buffer(name: str, shape: Tuple[int, ...]) -> np.ndarray:
+    """Returns the named uint8 buffer of the specified shape, allocated once per name, shape and thread.
 
     Args:
-        image (cv2.Mat): the image to process.
+        name (str): the name of the buffer, distinguishing the buffers of the same shape.
+        shape (Tuple[int, ...]): the shape of the buffer.
+
+    Returns:
+        np.ndarray: the uninitialized buffer.
+    """
+    if not hasattr(scratch, "buffers"):
+        scratch.buffers = {}
+
+    if (name, shape) not in scratch.buffers:
+        scratch.buffers[name, shape] = np.empty(shape, np.uint8)
+
+    return scratch.buffers[name, shape]
+
+
+def grayscale_image(image: cv2.Mat, *, bgr: bool = False, equalize: bool = False) -> cv2.Mat:
+    """Converts the specified image to grayscale as expected by the Haar classifier, optionally equalizing it.
+
+    The equalization is off by default since the Haar features are normalized by the window variance, which already
+    makes them invariant to linear illumination changes.
+
+    Args:
+        image (cv2.Mat): the RGB image to process.
+        bgr (bool, optional): if True, the image is in BGR order like the OpenCV frames. Defaults to False.
+        equalize (bool, optional): if True, also equalizes the histogram of the image. Defaults to False.
+
+    Returns:
+        cv2.Mat: the grayscale image, either an OpenCL device image if OpenCL is in use, or a scratch buffer
+        overwritten by the next call of the same thread.
+    """
+    # applies the luma weights to the matching channels
+    code: int = cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY
+
+    # uploads the image once so that the preprocessing and the detection run as OpenCL kernels
+    if cv2.ocl.useOpenCL():
+        grayscale = cv2.cvtColor(cv2.UMat(image), code)
+        return cv2.equalizeHist(grayscale) if equalize else grayscale
+
+    grayscale = get_scratch_buffer("grayscale", image.shape[:2])
+    cv2.cvtColor(image, code, dst=grayscale)
+
+    if equalize:
+        equalized = get_scratch_buffer("equalized", image.shape[:2])
+        return cv2.equalizeHist(grayscale, dst=equalized)
+    return grayscale
+
+
+def get_faces(image: cv2.Mat, *, scale: float = 0.5, bgr: bool = False) -> List[vec4]:
+    """Returns the faces detected in the specified image using the DNN detector if loaded, the Haar cascade otherwise.
+
+    Args:
+        image (cv2.Mat): the RGB image to process.
         scale (float, optional): the scale factor to apply. Defaults to 0.5 (half the size of the image).
+        bgr (bool, optional): if True, the image is in BGR order like the OpenCV frames. Defaults to False.
 
     Returns:
         List[Tuple[int, int, int, int]]: the faces detected in the specified image.
     """
-    # reduces the image size by 2 to improve the detection
-    image: cv2.Mat = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-
-    # converts the image to grayscale and equalizes its histogram
-    grayscale: cv2.Mat = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    grayscale: cv2.Mat = cv2.equalizeHist(grayscale)
-
-    # TODO timer pour le temps de détection
-    # TODO mettre une minsize en forme de visage et plus grande que 30
-    faces = classifier.detectMultiScale(
-        grayscale,
-        scaleFactor=1.3,
-        minNeighbors=6,
-        minSize=(30, 30),
-        flags=cv2.CASCADE_SCALE_IMAGE,
-    )
+    # reduces the image size by 2 to improve the detection, into a buffer reused across the probes
+    height, width = round(image.shape[0] * scale), round(image.shape[1] * scale)
+    resized = get_scratch_buffer("resized", (height, width, *image.shape[2:]))
+    image: cv2.Mat = cv2.resize(image, (width, height), dst=resized, interpolation=cv2.INTER_LINEAR)
+
+    if detector is not None:
+        # swaps the RGB channels to the BGR order the model was trained on, cheap at the reduced size
+        if not bgr:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=get_scratch_buffer("bgr", image.shape))
+
+        # runs a single forward pass on the color image, the boxes being the first four columns
+        with detector_lock:
+            detector.setInputSize((image.shape[1], image.shape[0]))
+            _, faces = detector.detect(image)
+        faces = [] if faces is None else faces[:, :4]
+    else:
+        # TODO timer pour le temps de détection
+        # the minimum size skips the smallest scales of the pyramid, a webcam face being larger than 80px in 1080p
+        faces = get_classifier().detectMultiScale(
+            grayscale_image(image, bgr=bgr),
+            scaleFactor=1.3,
+            minNeighbors=6,
+            minSize=(40, 40),
+            flags=cv2.CASCADE_SCALE_IMAGE,
+        )
 
     return [[int(coord / scale) for coord in face] for face in faces]
 
 
-def find_crop(image: cv2.Mat, face: vec4, *, scale: float = 1, ratio: float = 16 / 9) -> vec4:
-    """Finds the crop coordinates for the specified image and face.
+# pylint: disable=too-many-arguments
+@njit("UniTuple(int64, 4)(int64, int64, int64, int64, int64, int64, float64, float64)", cache=True, boundscheck=False)
+def find_crop(img_h: int, img_w: int, x: int, y: int, w: int, h: int, scale: float, ratio: float) -> vec4:
+    """Finds the crop coordinates for the specified image size and face.
 
     Args:
-        image (cv2.Mat): the image to process.
-        face (vec4): the face coordinates.
-        scale (float, optional): the scale factor to apply. Defaults to 1.
-        ratio (float, optional): the ratio to satisfy. Defaults to 16/9.
+        img_h (int): the height of the image to process.
+        img_w (int): the width of the image to process.
+        x (int): the abscissa of the face.
+        y (int): the ordinate of the face.
+        w (int): the width of the face.
+        h (int): the height of the face.
+        scale (float): the scale factor to apply.
+        ratio (float): the ratio to satisfy.
 
     Returns:
         vec4: the crop coordinates.
     """
-    x, y, w, h = face  # pylint: disable=invalid-name
-    center: Tuple[int, int] = x + w // 2, y + h // 2
-
-    if w > h * ratio:
-        neww = int(w * scale)
-        newh = int(neww / ratio)
-        newx = center[0] - neww // 2
-        newy = center[1] - newh // 2
-    else:
-        newh = int(h * scale)
-        neww = int(newh * ratio)
-        newy = center[1] - newh // 2
-        newx = center[0] - neww // 2
-
-    if neww >= image.shape[1]:
-        neww = image.shape[1]
-        newh = int(neww / ratio)
-        newy = center[1] - newh // 2
-        newx = 0
-    elif newh >= image.shape[0]:
-        newh = image.shape[0]
-        neww = int(newh * ratio)
-        newx = center[0] - neww // 2
-        newy = 0
-
-    if newx < 0:
-        newx = 0
-    elif newx + neww > image.shape[1]:
-        newx = image.shape[1] - neww
-
-    if newy < 0:
-        newy = 0
-    elif newy + newh > image.shape[0]:
-        newy = image.shape[0] - newh
+    center_x, center_y = x + w // 2, y + h // 2
+
+    # scales the dominant side of the face and derives the other one from the ratio
+    wide = w > h * ratio
+    neww = int(w * scale) if wide else int(int(h * scale) * ratio)
+    newh = int(neww / ratio) if wide else int(h * scale)
+
+    # shrinks the crop to fit the image, the width taking precedence over the height
+    over_w = neww >= img_w
+    over_h = not over_w and newh >= img_h
+    neww, newh = (img_w, int(img_w / ratio)) if over_w else ((int(img_h * ratio), img_h) if over_h else (neww, newh))
+
+    # centers the crop on the face and clamps it inside the image
+    newx = max(0, min(center_x - neww // 2, img_w - neww))
+    newy = max(0, min(center_y - newh // 2, img_h - newh))
 
     return newx, newy, neww, newh
 
 
-def sharpen_image(image: cv2.Mat) -> cv2.Mat:
-    kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-    return cv2.filter2D(image, -1, kernel)
+@njit("UniTuple(int64, 2)(int64, int64, int64, int64)", cache=True)
+def find_tile(i: int, width: int, height: int, border_size: int) -> Tuple[int, int]:
+    """Finds the top left corner of the specified tile in the cross shaped thumbnail.
+
+    Args:
+        i (int): the index of the tile, from left to right then top to bottom.
+        width (int): the width of a quarter of the thumbnail.
+        height (int): the height of a quarter of the thumbnail.
+        border_size (int): the size of the borders around the tiles.
+
+    Returns:
+        Tuple[int, int]: the abscissa and the ordinate of the tile.
+    """
+    return (width - border_size // 2) * (i % 2) + border_size, (height - border_size // 2) * (i // 2) + border_size
+
+
+def warp_crop(image: cv2.Mat, crop: vec4, destination: cv2.Mat, **kwargs) -> cv2.Mat:
+    """Crops the specified image and resizes the crop into the destination in a single affine warp.
+
+    Args:
+        image (cv2.Mat): the image to process.
+        crop (vec4): the crop coordinates in the image.
+        destination (cv2.Mat): the image or view where to write the resized crop in place.
+        kwargs (Dict[str, Any]): the optional warp arguments like the border mode and value.
+
+    Returns:
+        cv2.Mat: the destination.
+    """
+    x, y, w, h = crop
+    height, width = destination.shape[:2]
+    fx, fy = width / w, height / h
+
+    # slices the crop first so that a strided view (like a channel swap) is only copied over the cropped region
+    image = image[y : y + h, x : x + w]
+
+    # scales the crop to the destination size, pixel centers being aligned the way cv2.resize does
+    matrix = np.array([[fx, 0, 0.5 * fx - 0.5], [0, fy, 0.5 * fy - 0.5]], dtype=np.float32)
+    kwargs.setdefault("borderMode", cv2.BORDER_REPLICATE)
+
+    return cv2.warpAffine(image, matrix, (width, height), dst=destination, flags=cv2.INTER_LINEAR, **kwargs)
+
+
+def sharpen_image(image: cv2.Mat, dst: Optional[cv2.Mat] = None) -> cv2.Mat:
+    """Sharpens the specified image by subtracting its Laplacian, like the [[0, -1, 0], [-1, 5, -1], [0, -1, 0]] kernel.
+
+    Args:
+        image (cv2.Mat): the 8-bit image to process.
+        dst (Optional[cv2.Mat], optional): the output image, can be the image itself. Defaults to None.
+
+    Returns:
+        cv2.Mat: the sharpened image.
+    """
+    # the 16-bit Laplacian keeps the negative responses, the subtraction saturating back to 8-bit
+    laplacian = cv2.Laplacian(image, cv2.CV_16S, ksize=1)
+    return cv2.subtract(image, laplacian, dst=dst, dtype=cv2.CV_8U)
+
+
+def read_url_image(url: str, timeout: float = 10) -> cv2.Mat:
+    """Downloads and decodes the image at the specified url in memory, without a temporary file.
+
+    Args:
+        url (str): the url of the image.
+        timeout (float, optional): the request timeout in seconds. Defaults to 10.
+
+    Returns:
+        cv2.Mat: the decoded BGR image, None if the data could not be decoded.
+    """
+    response = SESSION.get(url, timeout=timeout)
+    response.raise_for_status()
+
+    return cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
+
+
+# the thumbnail buffer reused across the edit runs, which makes get_thumbnail neither reentrant nor thread-safe
+thumbnail_buffer: np.ndarray = np.empty((1080, 1920, 3), np.uint8)
+
+
+@lru_cache(maxsize=4)
+def get_edge_distance(height: int, width: int) -> np.ndarray:
+    """Returns the distance of each pixel to the closest edge of the image, capped and normalized between 0 and 1.
+
+    Args:
+        height (int): the height of the image.
+        width (int): the width of the image.
+
+    Returns:
+        np.ndarray: the read-only float32 distance map of shape (height, width).
+    """
+    # builds the normalized coordinates as broadcastable float32 vectors instead of float64 meshgrids
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+
+    # computes the distance to the closest edge, capped and normalized in place
+    d = np.minimum(np.minimum(x, 1 - x), np.minimum(y, 1 - y))
+    np.minimum(d, 0.01, out=d)
+    d /= d.max()
+
+    # freezes the shared map since it is returned to every caller
+    d.flags.writeable = False
+    return d
 
 
 def get_thumbnail(
@@ -145,31 +338,23 @@ def get_thumbnail(
     scale: float = 1.5,
 ):
     if not subimages:
-        return cv2.imread(get_url_content(default["thumbnail_url"]))
+        return read_url_image(default["thumbnail_url"])
         # TODO resize 480x272 to 1920x1080
 
     # TODO get_gradiant
 
-    # fills the thumbnail with black pixels in column-major order
+    # reuses the module thumbnail buffer, entirely overwritten by the gradient below
     # thumbnail = np.full((1080, 1920, len(border_color)), border_color, np.uint8)
-    thumbnail = np.zeros((1080, 1920, 3), np.uint8)
+    thumbnail = thumbnail_buffer
 
     def paint_gradient(thumbnail: cv2.Mat, primary: vec3, secondary: vec3, tertiary: vec3 = None):
-        y = np.linspace(0, 1, thumbnail.shape[0])
-        x = np.linspace(0, 1, thumbnail.shape[1])
-        xv, yv = np.meshgrid(x, y)
-
-        zz = np.sqrt(xv**2 + yv**2)
-
-        # if (zz > 1).any():
-        #     zz = zz / zz.max()
+        # gets the normalized distance to the closest edge, computed once per thumbnail size
+        d = get_edge_distance(*thumbnail.shape[:2])
 
-        # thumbnail[:, :, 0] = (zz * 255).astype(np.uint8)
-        # 2
-        d = np.minimum(0.01, np.minimum(np.minimum(xv, yv), np.minimum(1 - xv, 1 - yv)))
-        d = d / d.max()
-
-        thumbnail[:, :] = primary * d[:, :, None] + secondary * (1 - d[:, :, None])
+        # blends the colors as secondary + (primary - secondary) * d in a single float32 buffer
+        blend = np.multiply(d[:, :, None], np.subtract(primary, secondary, dtype=np.float32))
+        np.add(blend, np.asarray(secondary, dtype=np.float32), out=blend)
+        thumbnail[:, :] = blend
         # thumbnail[:, :, 0] = (np.sin(xv * 2 * np.pi) * 127 + 128).astype(np.uint8)
         # thumbnail[:, :, 1] = (np.sin(yv * 2 * np.pi) * 127 + 128).astype(np.uint8)
         # thumbnail[:, :, 2] = (np.sin((xv + yv) * 2 * np.pi) * 127 + 128).astype(np.uint8)
@@ -186,48 +371,81 @@ def get_thumbnail(
         for i, (face, subimage) in enumerate(subimages.values()):
             # finds the largest crop around the face respecting the specified ratio
             dsize = (width - int(border_size * 1.5), height - int(border_size * 1.5))
-            x, y, w, h = find_crop(subimage, face, scale=scale, ratio=dsize[0] / dsize[1])
-
-            # crops the subimage to fit the crop
-            subimage = subimage[y : y + h, x : x + w]
-
-            # resizes the subimage the thumbnail quarter less the borders size
-            subimage = cv2.resize(subimage, dsize)
-
-            # TODO Suppr subimage = cv2.copyMakeBorder(subimage, *([border_size] * 4), cv2.BORDER_CONSTANT, value=border_color)
+            crop = find_crop(*subimage.shape[:2], *face, scale, dsize[0] / dsize[1])
 
             # retrieves the coordinates of the subimage in the thumbnail
-            x, y = (width - border_size // 2) * (i % 2) + border_size, (height - border_size // 2) * (
-                i // 2
-            ) + border_size
+            x, y = find_tile(i, width, height, border_size)
 
-            # adds the subimage to the thumbnail
-            thumbnail[y : y + subimage.shape[0], x : x + subimage.shape[1]] = subimage  # (subimage)
+            # crops and resizes the subimage straight into its quarter of the thumbnail less the borders size
+            warp_crop(subimage, crop, thumbnail[y : y + dsize[1], x : x + dsize[0]])
     else:
         height, width = thumbnail.shape[0], thumbnail.shape[1] // len(subimages)
 
         # resizes and crops vertically the subimages onto the thumbnail
         for i, (face, subimage) in enumerate(subimages.values()):
-            # crops the largest subimage around the face respecting the specified ratio
-            x, y, w, h = find_crop(subimage, face, scale=scale, ratio=16 / 9 / len(subimages))
-            subimage = subimage[y : y + h, x : x + w]
-            subimage = cv2.resize(
-                subimage, (width - int(border_size + border_size / len(subimages)), height - border_size * 2)
-            )
-            subimage = cv2.copyMakeBorder(subimage, *([border_size] * 4), cv2.BORDER_CONSTANT, value=border_color)
+            # finds the largest crop around the face respecting the specified ratio
+            crop = find_crop(*subimage.shape[:2], *face, scale, 16 / 9 / len(subimages))
 
+            # retrieves the size of the strip including its borders and its abscissa in the thumbnail
+            dsize = (width - int(border_size + border_size / len(subimages)), height - border_size * 2)
+            strip = dsize[0] + border_size * 2
             x = (width - int(border_size / len(subimages))) * i
             if i == len(subimages) - 1:
-                x = thumbnail.shape[1] - subimage.shape[1]
+                x = thumbnail.shape[1] - strip
 
-            print(x, subimage.shape[1])
-            print(i, subimage.shape, (width - border_size * scale, height - border_size * scale))
+            # paints the four border bands only, the inner region being written once by the warp
+            thumbnail[:border_size, x : x + strip] = border_color
+            thumbnail[border_size + dsize[1] :, x : x + strip] = border_color
+            thumbnail[border_size : border_size + dsize[1], x : x + border_size] = border_color
+            thumbnail[border_size : border_size + dsize[1], x + border_size + dsize[0] : x + strip] = border_color
 
-            thumbnail[: subimage.shape[0], x : x + subimage.shape[1]] = subimage
+            # crops and resizes the subimage straight inside its borders
+            region = thumbnail[border_size : border_size + dsize[1], x + border_size : x + border_size + dsize[0]]
+            warp_crop(subimage, crop, region)
 
     return thumbnail
 
 
+@lru_cache(maxsize=32)
+def get_text_size(text: str, font: int, scale: float, thickness: int) -> Tuple[Tuple[int, int], int]:
+    """Returns the size of the specified text, memoized since the computation is deterministic.
+
+    Args:
+        text (str): the text to measure.
+        font (int): the OpenCV font face.
+        scale (float): the font scale factor.
+        thickness (int): the thickness of the strokes.
+
+    Returns:
+        Tuple[Tuple[int, int], int]: the width and height of the text, and the baseline ordinate.
+    """
+    return cv2.getTextSize(text, font, scale, thickness)
+
+
+@lru_cache(maxsize=32)
+def get_label(broadcaster_name: str) -> TextClip:
+    """Renders the label of the specified broadcaster, memoized since each rendering runs an ImageMagick process.
+
+    The returned clip is shared between the calls and must not be modified in place, the MoviePy setters returning
+    modified copies.
+
+    Args:
+        broadcaster_name (str): the name of the broadcaster.
+
+    Returns:
+        TextClip: the label of the broadcaster.
+    """
+    return TextClip(
+        txt=("  " + broadcaster_name).ljust(20),
+        method="label",
+        fontsize=60,
+        color="white",
+        bg_color="rgb(145, 70, 255)",  # TODO mettre custom twitch bg-color
+        # stroke_color="black",
+        # stroke_width=1,
+    )
+
+
 def compose_clip(file: str, broadcaster_name: str, **kwargs) -> CompositeVideoClip:
     """Composes a clip from the specified temporary file. Adds a textclip with the specified broadcaster name.
 
@@ -242,19 +460,11 @@ def compose_clip(file: str, broadcaster_name: str, **kwargs) -> CompositeVideoCl
     # videoclip creation and normalization
     videoclip: VideoFileClip = VideoFileClip(file)
     videoclip = videoclip.subclip(0, kwargs.get("duration", videoclip.duration))
-    resize(videoclip, width=kwargs.get("width", 1920), height=kwargs.get("height", 1080))
+    videoclip = videoclip.fx(resize, newsize=(kwargs.get("width", 1920), kwargs.get("height", 1080)))
     videoclip = videoclip.fx(audio_normalize)
 
-    # textclip creation and normalisation
-    textclip = TextClip(
-        txt=("  " + broadcaster_name).ljust(20),
-        method="label",
-        fontsize=60,
-        color="white",
-        bg_color="rgb(145, 70, 255)",  # TODO mettre custom twitch bg-color
-        # stroke_color="black",
-        # stroke_width=1,
-    )
+    # textclip creation and normalisation, the label being rendered once per broadcaster
+    textclip: TextClip = get_label(broadcaster_name)
     from math import exp
 
     textclip = textclip.set_duration(min(videoclip.duration, 6)).set_start(1.42)
@@ -279,85 +489,194 @@ def compose_clip(file: str, broadcaster_name: str, **kwargs) -> CompositeVideoCl
     # merges subclip and textclip into a composite clip
     composite: CompositeVideoClip = CompositeVideoClip([videoclip, textclip]).set_duration(videoclip.duration)
 
-    # releases the video, audio and text resources
+    # releases the video and audio resources, the cached label being shared with the other clips
     videoclip.close()
-    textclip.close()
 
     return composite
 
 
-def ne(data: Iterable[Union[Any, Dict[str, Any]]], key: Optional[str], i: int, j: int) -> bool:
-    """Tests if the specified list elements are different.
+def find_face(file: str, duration: float, samples: int = 10) -> Optional[Tuple[vec4, cv2.Mat]]:
+    """Finds the first face in the specified video file, sampling a frame every 10% of its duration by default.
 
     Args:
-        data (Iterable[Union[Any, Dict[str, Any]]]): the data to be tested.
-        key (Optional[str]): the key to use for the dictionaries comparison.
-        i (int): the first index (must be in range of data).
-        j (int): the second index (must be in range of data).
+        file (str): the path to the video file to probe.
+        duration (float): the duration of the video to probe, in seconds.
+        samples (int, optional): the number of frames to sample at most. Defaults to 10.
 
     Returns:
-        bool: True if the specified data elements are different, False otherwise.
+        Optional[Tuple[vec4, cv2.Mat]]: the first face found and its BGR frame, None if no face is found.
     """
-    return data[i][key] != data[j][key]
+    step = max(1, int(ceil(duration / samples)))
+
+    # decodes the raw file in process, each sample being a native seek instead of a restart of the MoviePy reader
+    capture = cv2.VideoCapture(file)
+    try:
+        for timestamp in range(0, ceil(duration), step):
+            capture.set(cv2.CAP_PROP_POS_MSEC, timestamp * 1000)
+            success, image = capture.read()
+            if not success:
+                break
+
+            faces = get_faces(image, bgr=True)
+            if len(faces) > 0:
+                LOGGER.debug("face found at %ds of the clip", timestamp)
+                return faces[0], image
+    finally:
+        capture.release()
+
+    LOGGER.debug("no face found in the clip")
+    return None
+
 
+def compose_clips(
+    clips: Iterable[Dict[str, Any]], *, prefetch: int = 4, buffer: int = 2
+) -> Iterator[Tuple[Dict[str, Any], CompositeVideoClip]]:
+    """Downloads and composes the specified clips in background threads, yielding them in order as they are ready.
 
-def dfs(data: Iterable[Union[Any, Dict[str, Any]]], key: Optional[str] = None, i: int = 0) -> bool:
-    """Shuffles the specified data to avoid having the same broadcaster twice in a row.
+    The downloads run on a thread pool at most `prefetch` clips ahead while a single thread composes the downloaded
+    clips into a bounded queue, so that the network, the FFmpeg decoding and the caller's processing overlap with at
+    most `buffer` clips ahead.
 
     Args:
-        data (Iterable[Union[Any, Dict[str, Any]]]): either a list of elements or a list of dictionaries.
+        clips (Iterable[Dict[str, Any]]): the clips to download and compose.
+        prefetch (int, optional): the maximum number of downloads in flight. Defaults to 4.
+        buffer (int, optional): the maximum number of composed clips waiting to be consumed. Defaults to 2.
+
+    Yields:
+        Tuple[Dict[str, Any], CompositeVideoClip]: the clip data and its composed clip.
+    """
+    composites: queue.Queue = queue.Queue(maxsize=buffer)
+    stop = threading.Event()
+
+    def compose_worker(executor: ThreadPoolExecutor):
+        try:
+            # keeps a sliding window of downloads in flight, the files being consumed in the clips order
+            downloads: Deque[Tuple[Dict[str, Any], Future]] = deque()
+            pending: Iterator[Dict[str, Any]] = iter(clips)
+
+            while True:
+                while len(downloads) < prefetch and (clip := next(pending, None)) is not None:
+                    downloads.append((clip, executor.submit(get_url_content, clip["clip_url"])))
+                if not downloads or stop.is_set():
+                    break
+
+                clip, download = downloads.popleft()
+                composite = compose_clip(
+                    download.result(), clip["broadcaster_name"], duration=clip["duration"], width=1920, height=1080
+                )
+                composites.put((clip, composite))
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            # forwards the error to the consumer which raises it back
+            composites.put(error)
+        finally:
+            composites.put(None)
+
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        worker = threading.Thread(target=compose_worker, args=(executor,), daemon=True)
+        worker.start()
+
+        item: Any = None
+        try:
+            while (item := composites.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # unblocks the worker if the consumer stopped early, draining the queue until the end marker
+            stop.set()
+            while item is not None:
+                item = composites.get()
+            worker.join()
+
+
+def rearrange(data: List[Union[Any, Dict[str, Any]]], key: Optional[str] = None) -> bool:
+    """Reorders in place the specified data to avoid having the same broadcaster twice in a row.
+
+    The first element is kept in first place, then the elements are greedily picked from the most frequent value
+    that differs from the previous pick using a max-heap, which runs in O(n log k) for k distinct values.
+
+    Args:
+        data (List[Union[Any, Dict[str, Any]]]): either a list of elements or a list of dictionaries.
         key (Optional[str], optional): the key to use for the dictionaries comparison. Defaults to None.
-        i (int, optional): the start index (0 or 1 expected). Defaults to 0.
 
     Returns:
-        bool: True if the data has been shuffled or is already, False otherwise which means this is an impossible sort.
+        bool: True if the data has been rearranged or already is, False otherwise which means this is an impossible
+        sort.
     """
-    if len(data) < 3 or i == len(data):
+    if len(data) < 3:
         return True
 
-    if i == 0 or ne(data, key, i, i):
-        if dfs(data, key, i + 1):
-            return True
-
-    for j in range(i + 1, len(data)):
-        if i == 0 or ne(data, key, i - 1, j):
-            data[i], data[j] = data[j], data[i]
+    # groups the elements by value keeping their relative order
+    groups: Dict[Any, Deque[Any]] = defaultdict(deque)
+    for element in data:
+        groups[element[key] if key else element].append(element)
 
-            if dfs(data, key, i + 1):
-                return True
+    # the value of the first element can fill one place out of two, the other values cannot take the first place
+    first = data[0][key] if key else data[0]
+    if any(len(group) > (len(data) + (value == first)) // 2 for value, group in groups.items()):
+        # see separate for a best effort fallback
+        return False
 
-            data[i], data[j] = data[j], data[i]
+    # pins the first element, its value being held back for one round and the others pushed onto a max-heap
+    arrangement: List[Any] = [groups[first].popleft()]
+    heap = [(-len(group), rank, value) for rank, (value, group) in enumerate(groups.items()) if value != first]
+    heapq.heapify(heap)
+    held: Optional[Tuple[int, int, Any]] = (-len(groups[first]), 0, first) if groups[first] else None
 
-    return False
+    # pops the most frequent value each time, the last picked value being held back for one round
+    while heap:
+        count, rank, value = heapq.heappop(heap)
+        arrangement.append(groups[value].popleft())
+        if held:
+            heapq.heappush(heap, held)
+        held = (count + 1, rank, value) if count + 1 < 0 else None
 
+    data[:] = arrangement
+    return True
 
-def rearrange(clips: List[Dict[str, str]], key: str, max_length: int = 15) -> List[Dict[str, str]]:
-    # TODO docstring
-    # rule never 2 clips from the same broadcaster in a row
-    # shuffles the clips to avoid having the same broadcaster twice in a row
 
-    if len(clips) < max_length and dfs(clips, key, 1):
-        return clips
+def separate(data: List[Union[Any, Dict[str, Any]]], key: Optional[str] = None) -> int:
+    """Reorders in place the specified data to have as few consecutive equal elements as possible.
 
-    # TODO faire une fonction de fall_back
-    # for i in range(len(clips) - 1):
-    #     broadcaster_name = clips[i][key]
-
-    #     if broadcaster_name == clips[i + 1][key]:
-    #         for j in range(1, len(clips)):
-    #             if (
-    #                 j != i
-    #                 and j != i + 1
-    #                 and broadcaster_name not in (clips[k][key] for k in range(j - 1, min(j + 2, len(clips))))
-    #                 and (i + 2 >= len(clips) or clips[j][key] != clips[i + 2][key])
-    #             ):
-    #                 clips[i + 1], clips[j] = clips[j], clips[i + 1]
-    #                 break
-
-    return clips
+    This is the fallback of :func:`rearrange` when no valid order exists, meaning that a value fills more than half of
+    the places: each other element is followed by one of the dominant value, the dominant elements left being
+    gathered at the end. The first element is kept in first place and the relative order of equal elements is kept.
 
+    Args:
+        data (List[Union[Any, Dict[str, Any]]]): either a list of elements or a list of dictionaries.
+        key (Optional[str], optional): the key to use for the dictionaries comparison. Defaults to None.
 
-@call_before_after(urlcleanup)
+    Returns:
+        int: the number of consecutive equal elements left.
+    """
+    if not data:
+        return 0
+
+    # groups the elements by value keeping their relative order, the dominant value being the most frequent one
+    groups: Dict[Any, Deque[Any]] = defaultdict(deque)
+    for element in data:
+        groups[element[key] if key else element].append(element)
+    first = data[0][key] if key else data[0]
+    dominant = max(groups, key=lambda value: len(groups[value]))
+    dominants: Deque[Any] = groups[dominant]
+
+    # interleaves the dominant elements after the first one and after each other element
+    arrangement: List[Any] = [dominants.popleft()] if first == dominant else []
+    for element in data:
+        if (element[key] if key else element) != dominant:
+            arrangement.append(element)
+            if dominants:
+                arrangement.append(dominants.popleft())
+
+    # gathers the dominant elements left at the end
+    arrangement.extend(dominants)
+    data[:] = arrangement
+
+    values: List[Any] = [element[key] for element in data] if key else data
+    return sum(values[i] == values[i + 1] for i in range(len(values) - 1))
+
+
+@call_before_after(cleanup_url_contents)
 def edit(*, input: Optional[str] = None, output: Optional[str] = None):
     if input is None:
         # loads data from the database
@@ -367,13 +686,14 @@ def edit(*, input: Optional[str] = None, output: Optional[str] = None):
 
             # clips = mongo_db.get_documents("clips", limit=20)
 
+            # sorts before grouping so that the first document of each clip is the most relevant one
             query = {}
-            sort = {"view_count": -1, "created_at": -1}
-            project = {"data": {"$arrayElemAt": ["$data", 0]}}
-            group = {"data": {"$push": "$$ROOT"}, "_id": "$id"}
+            sort = MongoDB.CLIPS_INDEX
+            group = {"_id": "$id", "data": {"$first": "$$ROOT"}}
             replaceRoot = {"$replaceRoot": {"newRoot": "$data"}}
-            pipeline = mongo_db.build_pipeline(query, replaceRoot, sort=sort, project=project, group=group)
-            clips = mongo_db.get_documents("clips", pipeline)
+            resort = {"$sort": dict(sort)}
+            pipeline = mongo_db.build_pipeline(query, replaceRoot, resort, sort=sort, group=group)
+            clips = list(mongo_db.get_documents("clips", pipeline, hint=MongoDB.CLIPS_INDEX))
 
             # clips_id = [
             #     ObjectId("650c8e0251beaf12754f1a90"),
@@ -391,7 +711,7 @@ def edit(*, input: Optional[str] = None, output: Optional[str] = None):
     else:
         # stores the clips data in the filesystem
         # if output.endswith("/") or os.path.isdir(output):
-        #     output = get_latest_file(output)
+        #     output = descriptors.get_latest_file(output)
 
         # soit c'est un fichier soit un dossier
         clips = []
@@ -399,7 +719,7 @@ def edit(*, input: Optional[str] = None, output: Optional[str] = None):
 
     subclips = []
     subclips_duration = 0
-    timestamps = ""
+    timestamps: List[str] = []
     _credits: Set[str] = set()
     subimages: Dict[str, cv2.Mat] = {}
 
@@ -416,55 +736,48 @@ def edit(*, input: Optional[str] = None, output: Optional[str] = None):
     #     t2 = rearrange(inp, "broadcaster_name")
     #     print(is_valid(t2), t, [clip["broadcaster_name"][-1] for clip in t2])
 
-    rearrange(clips, key="broadcaster_name")
-
-    for clip in clips[:3]:
-        # retrieves clip url and downloads clip file
-        temporary_file: str = get_url_content(clip["clip_url"])
-        broadcaster_name: str = clip["broadcaster_name"]
-        LOGGER.debug("edit clip %s from %s", clip["_id"], broadcaster_name)
-
-        # TODO timer pour le file download
-        composite = compose_clip(temporary_file, broadcaster_name, duration=clip["duration"], width=1920, height=1080)
-
-        # adds crossfadein transition between subclips
-        if subclips:
-            composite = composite.fx(crossfadein, 1)
-
-        # appends composite clip to subclips
-        subclips.append(composite)
-
-        # updating timestamps and description
-        minutes = int(subclips_duration / 60)
-        seconds = int(subclips_duration % 60)
-        timestamp = f"{minutes:02d}:{seconds:02d}"
-        timestamps += f"{timestamp} {broadcaster_name}\n"
-        subclips_duration += composite.duration
-        credit = f"{broadcaster_name} - {clip['broadcaster_url']}"
-        _credits.add(credit)
-
-        # checks if the broadcaster has already been added to the subimages
-        if len(subimages) < 4 and broadcaster_name not in subimages:
-            # if no face has been detected, tries to find one in every 10% of the clip
-            faces = []
-            i = 0
-            step = int(ceil(composite.duration / 10))
-            while len(faces) < 1 and i < composite.duration:
-                image = composite.get_frame(i)
-                faces = get_faces(image)
-                i += step
-
-            # checks if a face has been detected
-            if len(faces) > 0:
-                subimages[broadcaster_name] = (faces[0], cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-                LOGGER.debug("face found in the %dth frame of the clip", i)
+    if not rearrange(clips, key="broadcaster_name"):
+        LOGGER.debug("%d clips left in a row from the same broadcaster", separate(clips, key="broadcaster_name"))
+
+    # probes the faces in parallel while the next clips are being composed
+    probes: Dict[str, Future] = {}
+    with ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1)) as prober:
+        # downloads and composes the clips in the background, the face detection and the accounting staying in order
+        for clip, composite in compose_clips(clips[:3]):
+            broadcaster_name: str = clip["broadcaster_name"]
+            LOGGER.debug("edit clip %s from %s", clip["_id"], broadcaster_name)
+
+            # adds crossfadein transition between subclips
+            if subclips:
+                composite = composite.fx(crossfadein, 1)
+
+            # appends composite clip to subclips
+            subclips.append(composite)
+
+            # updating timestamps and description
+            minutes, seconds = divmod(int(subclips_duration), 60)
+            timestamps.append(f"{minutes:02d}:{seconds:02d} {broadcaster_name}\n")
+            subclips_duration += composite.duration
+            credit = f"{broadcaster_name} - {clip['broadcaster_url']}"
+            _credits.add(credit)
+
+            # probes the first clip of each broadcaster until four faces have been found by the completed probes
+            found = sum(1 for probe in probes.values() if probe.done() and probe.result() is not None)
+            if found < 4 and broadcaster_name not in probes:
+                # decodes the downloaded file of the bare video (the first layer of the composite) on its own
+                videoclip: VideoFileClip = composite.clips[0]
+                probes[broadcaster_name] = prober.submit(find_face, videoclip.filename, videoclip.duration)
             else:
-                LOGGER.debug("no face found in the clip")
-        else:
-            LOGGER.debug("face detection skipped to avoid repeating the same broadcaster face")
+                LOGGER.debug("face detection skipped to avoid repeating the same broadcaster face")
+
+        # keeps the faces of the first four broadcasters in the clips order, like a sequential probing would
+        for broadcaster_name, probe in probes.items():
+            if len(subimages) < 4 and (subimage := probe.result()) is not None:
+                subimages[broadcaster_name] = subimage
 
     if subclips:
-        print(subimages.keys())
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("thumbnail faces from %s", ", ".join(subimages))
         # prompt video title
         title = clips[0]["title"]
         # from transformers import AutoModelForSequenceClassification
@@ -498,34 +811,69 @@ def edit(*, input: Optional[str] = None, output: Optional[str] = None):
         thickness = 20
 
         # gets the boundary of this text
-        (text_width, text_height), baseline = cv2.getTextSize(title, font, scale, thickness)
+        (text_width, text_height), baseline = get_text_size(title, font, scale, thickness)
         bottomLeftCornerOfText = ((1920 - text_width) // 2, (1080 + text_height) // 2)
 
         # bottomLeftCornerOfText = ((1920 - text_width) // 2, 1080 // 2 + baseline)
         # thickness // 2
 
+        # fills the text background in place, the bottom right corner of the rectangle being inclusive
         merge = 0
-        thumbnail[
-            (1080 - text_height) // 2 - merge : (1080 + text_height) // 2 + merge,
-            (1920 - text_width) // 2 - merge : (1920 + text_width) // 2 + merge,
-        ] = (0, 0, 0)
+        cv2.rectangle(
+            thumbnail,
+            ((1920 - text_width) // 2 - merge, (1080 - text_height) // 2 - merge),
+            ((1920 + text_width) // 2 + merge - 1, (1080 + text_height) // 2 + merge - 1),
+            (0, 0, 0),
+            cv2.FILLED,
+        )
         cv2.putText(thumbnail, title, bottomLeftCornerOfText, font, scale, color, thickness)
-        thumbnail[bottomLeftCornerOfText[1] - baseline, :] = (0, 0, 255)
+
+        # draws the text baseline as a visual guide in debug mode only
+        if DEBUG:
+            thumbnail[bottomLeftCornerOfText[1] - baseline, :] = (0, 0, 255)
 
         filename = r"thumbnail.png"
         if os.path.exists(filename):
             os.remove(filename)
         cv2.imwrite(filename, thumbnail)
 
-        description = "🎥 Credits:\n" + "\n".join(list(_credits)[::-1]) + "\n\n⌚ Timestamps:\n" + timestamps
+        credit_lines = "\n".join(list(_credits)[::-1])
+        description = "🎥 Credits:\n" + credit_lines + "\n\n⌚ Timestamps:\n" + "".join(timestamps)
         local_file = r"clips.mp4"
 
         write_video(subclips, local_file)
 
-    print("edit", input, output)
+    LOGGER.debug("edit from %s to %s", input, output)
     # TODO laoder
 
 
+# the hardware H.264 encoders by order of preference, NVIDIA then Intel Quick Sync
+HARDWARE_ENCODERS: Tuple[str, ...] = ("h264_nvenc", "h264_qsv")
+
+
+@lru_cache(maxsize=1)
+def get_hardware_encoder() -> Optional[str]:
+    """Finds the first hardware H.264 encoder usable by the FFmpeg binary of MoviePy, the probes being run once.
+
+    Returns:
+        Optional[str]: the name of the hardware encoder if any is usable, otherwise None.
+    """
+    for encoder in HARDWARE_ENCODERS:
+        # encodes a fraction of a second of a blank source since listing the encoder does not prove a GPU is present
+        command = [get_setting("FFMPEG_BINARY"), "-hide_banner", "-loglevel", "error", "-f", "lavfi"]
+        command += ["-i", "nullsrc=s=256x256:d=0.1", "-c:v", encoder, "-f", "null", "-"]
+
+        try:
+            subprocess.run(command, capture_output=True, check=True, timeout=30)  # nosec
+        except (OSError, subprocess.SubprocessError):
+            LOGGER.debug("hardware encoder %s unavailable", encoder)
+            continue
+        return encoder
+
+    LOGGER.debug("no hardware encoder available, falling back to libx264")
+    return None
+
+
 def write_video(subclips: List[CompositeVideoClip], filename: str = r"clips.mp4"):
     # if the file already exists, deletes it
     if os.path.exists(filename):
@@ -534,10 +882,29 @@ def write_video(subclips: List[CompositeVideoClip], filename: str = r"clips.mp4"
     # returns the total number of CPU or None if undetermined
     threads: Optional[int] = os.cpu_count()
 
-    # sets the FPS and codec preset according to the debug mode
-    fps, preset = (15, "ultrafast") if DEBUG else (None, "placebo")
+    # sets the FPS and codec preset according to the debug mode, preferring the hardware encoder if any
+    fps = 15 if DEBUG else None
+    codec: Optional[str] = get_hardware_encoder()
+    if codec == "h264_nvenc":
+        # constant quality VBR capped in peak bitrate to keep the upload size bounded on high motion clips
+        preset = "p1" if DEBUG else "p4"
+        ffmpeg_params = ["-rc", "vbr", "-cq", "23", "-maxrate", "12M", "-bufsize", "16M"]
+    elif codec == "h264_qsv":
+        # the Quick Sync equivalent of the constant quality mode with the same peak bitrate cap
+        preset = "veryfast" if DEBUG else "medium"
+        ffmpeg_params = ["-global_quality", "23", "-maxrate", "12M", "-bufsize", "16M"]
+    else:
+        codec, preset, ffmpeg_params = "libx264", ("ultrafast" if DEBUG else "fast"), None
 
-    # merges the subclips into a single videofile
+    # merges the subclips into a single videofile, overlapping them for the crossfade transitions
     video: CompositeVideoClip = concatenate_videoclips(subclips, method="compose", padding=-1)
-    video.write_videofile(filename, codec="libx264", audio_codec="aac", fps=fps, preset=preset, threads=threads)
+    video.write_videofile(
+        filename,
+        codec=codec,
+        audio_codec="aac",
+        fps=fps,
+        preset=preset,
+        threads=threads,
+        ffmpeg_params=ffmpeg_params,
+    )
     video.close()
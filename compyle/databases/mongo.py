@@ -1,12 +1,14 @@
 import logging
 from collections import OrderedDict
-from datetime import datetime
+from datetime import datetime, timezone
 from functools import wraps
-from typing import Any, Dict, List, Optional, Tuple, Union
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
-from pymongo import ASCENDING, MongoClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
 from pymongo.collection import Collection
 from pymongo.database import Database
+from pymongo.errors import OperationFailure
 from pymongo.results import (
     DeleteResult,
     InsertManyResult,
@@ -14,6 +16,7 @@ from pymongo.results import (
     UpdateResult,
 )
 from pymongo.server_api import ServerApi, ServerApiVersion
+from pymongo.write_concern import WriteConcern
 from retrying import retry
 
 from compyle.settings import MONGO_CONFIG
@@ -51,6 +54,12 @@ def log_before_after(func):
 
 
 class MongoDB(metaclass=Singleton):
+    # the compound index serving the sort of the clips by popularity then recency
+    CLIPS_INDEX: List[Tuple[str, int]] = [("view_count", DESCENDING), ("created_at", DESCENDING)]
+
+    # the index serving the sort of the documents by most recent update
+    UPDATED_INDEX: List[Tuple[str, int]] = [("updated_at", DESCENDING)]
+
     def __init__(self):
         self.__connect()
 
@@ -72,6 +81,20 @@ class MongoDB(metaclass=Singleton):
         self.database: Database = self.client[MONGO_CONFIG.client_name]
         LOGGER.info("Connected to MongoDB database '%s'", self.database.name)
 
+        self.__create_indexes()
+
+    def __create_indexes(self):
+        """Creates the indexes used by the aggregation pipelines if they do not exist yet, in a single round trip."""
+        try:
+            indexes: List[str] = self.database["clips"].create_indexes(
+                [IndexModel(self.CLIPS_INDEX), IndexModel(self.UPDATED_INDEX)]
+            )
+        except OperationFailure as error:
+            # another client may be creating the same indexes concurrently
+            LOGGER.warning("Failed to ensure the indexes on collection 'clips': %s", error)
+        else:
+            LOGGER.debug("Indexes %s ensured on collection 'clips'", indexes)
+
     def __disconnect(self):
         """Disconnects from the MongoDB database."""
         if self.client:
@@ -110,16 +133,26 @@ class MongoDB(metaclass=Singleton):
         """
         return self.client[item]
 
-    def __normalize_document(self, document: dict) -> dict:
+    @staticmethod
+    def __timestamp() -> str:
+        """Returns the current UTC date formatted as 'YYYY-MM-DD HH:MM:SS.ffffff'.
+
+        Returns:
+            str: the current timestamp.
+        """
+        return datetime.now(timezone.utc).replace(tzinfo=None).isoformat(" ", "microseconds")
+
+    def __normalize_document(self, document: dict, timestamp: Optional[str] = None) -> dict:
         """Timestamps the document if necessary to keep track of creation and update date.
 
         Args:
             document (dict): the document to normalize.
+            timestamp (Optional[str], optional): the update date shared by a batch of documents. Defaults to now.
 
         Returns:
             dict: the normalized document.
         """
-        document["updated_at"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+        document["updated_at"] = timestamp or self.__timestamp()
         if "inserted_at" not in document:
             document["inserted_at"] = document["updated_at"]
 
@@ -138,18 +171,35 @@ class MongoDB(metaclass=Singleton):
         """
         return self.database[collection].insert_one(self.__normalize_document(document))
 
+    # pylint: disable=line-too-long
     @log_before_after
-    def insert_documents(self, collection: str, documents: List[dict]) -> InsertManyResult:
+    def insert_documents(
+        self, collection: str, documents: List[dict], *, fast: bool = False, batch_size: int = 1000
+    ) -> InsertManyResult:
         """Inserts the specified list of documents into the specified collection.
 
+        The documents are sent in unordered batches so that a single oversized payload does not exceed the BSON limit.
+
         Args:
             collection (str): the name of the collection. If the collection does not exist, it is created.
             documents (List[dict]): the list of documents to insert.
+            fast (bool, optional): if True, the writes are not acknowledged by the server (fire-and-forget), the document validation still applying since it cannot be bypassed without acknowledgement. Defaults to False.
+            batch_size (int, optional): the maximum number of documents sent per batch. Defaults to 1000.
 
         Returns:
             InsertManyResult: the result of the many insertions.
         """
-        return self.database[collection].insert_many(self.__normalize_document(document) for document in documents)
+        target: Collection = self.database[collection]
+        if fast:
+            target = target.with_options(write_concern=WriteConcern(w=0))
+
+        inserted_ids: List[Any] = []
+        timestamp: str = self.__timestamp()
+        normalized = (self.__normalize_document(document, timestamp) for document in documents)
+        while batch := list(islice(normalized, max(1, batch_size))):
+            inserted_ids.extend(target.insert_many(batch, ordered=False).inserted_ids)
+
+        return InsertManyResult(inserted_ids, not fast)
 
     @log_before_after
     def update_document(self, collection: str, document: dict) -> UpdateResult:
@@ -200,17 +250,27 @@ class MongoDB(metaclass=Singleton):
         self,
         collection: str,
         pipeline: List[Dict[str, Any]],
-    ) -> List[Any]:
+        hint: Optional[Union[str, List[Tuple[str, int]]]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[Any]:
         """Retrieves the documents from the specified collection.
 
+        The documents are streamed from the cursor batch by batch, the cursor being open until the client is closed.
+
         Args:
             collection (str): the name of the collection.
             pipeline (List[Dict[str, Any]]): the MongoDB query pipeline.
+            hint (Optional[Union[str, List[Tuple[str, int]]]], optional): the index to use, disables the disk usage if specified. Defaults to None.
+            batch_size (int, optional): the number of documents fetched per round trip. Defaults to 1000.
 
         Returns:
-            List[Any]: the list of documents.
+            Iterator[Any]: the cursor over the documents.
         """
-        return list(self.database[collection].aggregate(pipeline, allowDiskUse=True))
+        options: Dict[str, Any] = {"allowDiskUse": hint is None, "batchSize": max(1, batch_size)}
+        if hint:
+            options["hint"] = hint
+
+        return self.database[collection].aggregate(pipeline, **options)
 
     # pylint: disable=too-many-arguments, line-too-long
     @classmethod
@@ -243,7 +303,10 @@ class MongoDB(metaclass=Singleton):
         Returns:
             _Pipeline: the MongoDB query pipeline.
         """
-        pipeline: Dict[str, Any] = {"$match": match, "$skip": offset}
+        pipeline: Dict[str, Any] = {"$match": match}
+
+        if offset > 0:
+            pipeline["$skip"] = offset
 
         if limit > 0:
             pipeline["$limit"] = limit
@@ -5,6 +5,11 @@ from moviepy import config
 
 
 def launch_after_preload(method_callback, *args, **kwargs):
+    # the loggers and settings only need to be tweaked once per process
+    if getattr(launch_after_preload, "_done", False):
+        return method_callback(*args, **kwargs)
+    launch_after_preload._done = True
+
     logging.getLogger("PIL.PngImagePlugin").setLevel(logging.WARNING)
     # logging.getLogger("moviepy.editor").setLevel(logging.WARNING)
     logging.getLogger("imageio_ffmpeg").setLevel(logging.CRITICAL)
@@ -17,3 +22,5 @@ def launch_after_preload(method_callback, *args, **kwargs):
         # config.change_settings({"IMAGEMAGICK_BINARY": r"/bin/convert"})  # pour ubuntu
         dir = os.path.basename(os.path.dirname(__file__))
         # todo message pas bien warn
+
+    return method_callback(*args, **kwargs)
@@ -1,10 +1,17 @@
+import hashlib
+import json
 import logging
+import os
+import tempfile
+import threading
+import time
 from abc import ABC
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import IntEnum
+from functools import lru_cache
 from io import BufferedReader
-from typing import Any, Callable, KeysView
-from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
-from urllib.request import urlretrieve
+from typing import Any, Callable, Iterator, KeysView
+from urllib.parse import unquote_plus, urlencode, urlparse, urlunparse
 
 import requests
 from requests.adapters import HTTPAdapter
@@ -12,14 +19,42 @@ from rest_framework import status
 from urllib3.util import Retry
 
 import compyle.services.routes
+from compyle.settings import CACHE_FOLDER, DEBUG
 
 LOGGER = logging.getLogger(__name__)
 logging.getLogger("urllib3.connectionpool").setLevel(logging.WARNING)
 
+# the memory-backed folder where to download the temporary files if any, the default temporary folder otherwise
+TEMPORARY_FOLDER: str | None = "/dev/shm" if os.path.isdir("/dev/shm") else None  # nosec
+
+# the paths of the temporary files downloaded so far, removed by `cleanup_url_contents`
+temporary_files: list[str] = []
+
+# the server error statuses whose requests are retried
+RETRY_STATUSES: frozenset[int] = frozenset(
+    {
+        status.HTTP_500_INTERNAL_SERVER_ERROR,
+        status.HTTP_502_BAD_GATEWAY,
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        status.HTTP_504_GATEWAY_TIMEOUT,
+    }
+)
+
+# the retry strategy of the file downloads, retrying the server errors as well as the connection and read errors
+DOWNLOAD_RETRY = Retry(total=3, backoff_factor=0.5, status_forcelist=RETRY_STATUSES)
+
+# the session shared by the file downloads, keeping the connections alive across the concurrent downloads
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_maxsize=16, max_retries=DOWNLOAD_RETRY))
+SESSION.mount("https://", HTTPAdapter(pool_maxsize=16, max_retries=DOWNLOAD_RETRY))
+
 
 class Endpoint:
     """This class represents an endpoint for an API."""
 
+    # the pagination parameters, which change on every page and are therefore left out of the cached urls
+    CURSOR_PARAMS: frozenset[str] = frozenset({"after", "before"})
+
     def __init__(self, base_url: str, slug: str, req: list[str] | None = None, opt: list[str] | None = None):
         """Constructs a new instance of the `Endpoint` class.
 
@@ -30,10 +65,19 @@ class Endpoint:
             opt (list[str], optional): the list of optional url parameters.
 
         Raises:
+            ValueError: if the base url has a query or a fragment.
             ValueError: if the required and optional parameters are not disjoint.
         """
         self._base_url, self._slug = base_url, slug
-        self._required_params, self._optional_params = set(req or []), set(opt or [])
+
+        # the url without its query, parsed only once since the base url and the slug are fixed
+        components = urlparse(base_url)
+        if components.query or components.fragment:
+            raise ValueError("The base url must not have a query nor a fragment")
+        self._prefix: str = urlunparse(components._replace(path=components.path + slug))
+
+        self._required_params, self._optional_params = frozenset(req or []), frozenset(opt or [])
+        self._all_params: frozenset[str] = self._required_params | self._optional_params
 
         if self._required_params & self._optional_params:
             raise ValueError("Required and optional parameters must be disjoint")
@@ -56,18 +100,41 @@ class Endpoint:
         Returns:
             str: the unparsed URL built with the normalized query parameters.
         """
-        params = {k: query.get(k) for k in self._required_params | self._optional_params if k in query}
-
         # checks if all required parameters are present
-        if len(params) < len(self._required_params) or any(param not in params for param in self._required_params):
-            raise ValueError(f"Missing required non-null parameters in {self._required_params.difference(params)}")
+        if missing := self._required_params.difference(query):
+            raise ValueError(f"Missing required non-null parameters in {set(missing)}")
+
+        # normalizes the repeated parameters to tuples, encoded as one pair per value and hashable by the cache
+        params = {
+            k: tuple(v) if isinstance(v, (list, tuple, set, frozenset)) else v
+            for k, v in query.items()
+            if k in self._all_params
+        }
+        cursors = [(k, params.pop(k)) for k in sorted(self.CURSOR_PARAMS.intersection(params))]
+
+        # builds the url with the fixed part of the query, sorted so that identical queries share the same cache entry
+        url: str = self._encode_url(self._prefix, tuple(sorted(params.items())))
+        if not cursors:
+            return url
+
+        return f"{url}{'&' if '?' in url else '?'}{urlencode(cursors)}"
 
-        # builds the url with the normalized query
-        components = list(urlparse(self._base_url, allow_fragments=False))
-        components[2] += self._slug
-        components[4] = urlencode(params)
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _encode_url(prefix: str, params: tuple[tuple[str, Any], ...]) -> str:
+        """Appends the encoded parameters to the specified url prefix. The urls are memoized.
+
+        Args:
+            prefix (str): the url without its query.
+            params (tuple[tuple[str, Any], ...]): the parameters of the query as key-value pairs, a tuple value being
+                encoded as a repeated parameter.
+
+        Returns:
+            str: the url with its query if any parameter.
+        """
+        encoded: str = urlencode(params, doseq=True)
 
-        return urlunparse(components)
+        return f"{prefix}?{encoded}" if encoded else prefix
 
     @staticmethod
     def extract_url_params(url: str) -> list[tuple[str, str]]:
@@ -79,7 +146,19 @@ class Endpoint:
         Returns:
             list[tuple[str, str]]: the list of parameters, as G-d intended.
         """
-        return parse_qsl(urlparse(url).query, keep_blank_values=True)
+        return list(Endpoint.iter_url_params(url))
+
+    @staticmethod
+    def iter_url_params(url: str) -> Iterator[tuple[str, str]]:
+        """Iterates lazily over the parameters of the specified url.
+
+        Args:
+            url (str): the url to extract the parameters from.
+
+        Returns:
+            Iterator[tuple[str, str]]: the parameters in order of appearance.
+        """
+        return Endpoint._iter_query(url.partition("?")[2].partition("#")[0])
 
     @staticmethod
     def add_url_params(url: str, **params) -> str:
@@ -93,10 +172,27 @@ class Endpoint:
             str: the url with the parameters added.
         """
         parts = urlparse(url)
-        query = dict(parse_qsl(parts.query, keep_blank_values=True)).update(params)
+        query = {**dict(Endpoint._iter_query(parts.query)), **params}
 
         return urlunparse(parts._replace(query=urlencode(query)))
 
+    @staticmethod
+    def _iter_query(query: str) -> Iterator[tuple[str, str]]:
+        """Splits the specified query string into its decoded parameters, keeping the blank values.
+
+        It behaves as `urllib.parse.parse_qsl` with `keep_blank_values` for the well-formed queries of the APIs.
+
+        Args:
+            query (str): the query string without the leading question mark.
+
+        Yields:
+            tuple[str, str]: the parameters in order of appearance.
+        """
+        for pair in query.split("&"):
+            if pair:
+                key, _, value = pair.partition("=")
+                yield unquote_plus(key), unquote_plus(value)
+
 
 class Method(IntEnum):
     """This enum represents the HTTP methods supported by the API."""
@@ -137,18 +233,67 @@ class Method(IntEnum):
         return self.func.__str__()
 
 
+# the names of the supported HTTP methods
+ALLOWED_METHODS: frozenset[str] = frozenset(Method.__members__)
+
+
 class Router:
     """This class represents a router for an API."""
 
-    def __init__(self, *, trailing_slash: bool = True):
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        *,
+        trailing_slash: bool = True,
+        retries: int = 3,
+        backoff: float = 0.5,
+        jitter: float = 0.5,
+        pool_connections: int = 32,
+        pool_maxsize: int = 64,
+        session: requests.Session | None = None,
+        cache_ttl: float = 300,
+        cache_size: int = 128,
+    ):
         """Constructs a new instance of the Router class.
 
         Args:
             trailing_slash (bool, optional): tells if the route are suffixed with a trailing slash. Defaults to True.
+            retries (int, optional): the number of retries per request. Defaults to 3.
+            backoff (float, optional): the backoff factor in seconds. Defaults to 0.5.
+            jitter (float, optional): the backoff jitter in seconds. Defaults to 0.5.
+            pool_connections (int, optional): the number of hosts whose connections are pooled. Defaults to 32.
+            pool_maxsize (int, optional): the maximum number of connections kept per host. Defaults to 64.
+            session (requests.Session, optional): the session to share with another router, the retry and pool options
+                being ignored if specified. Defaults to a new session.
+            cache_ttl (float, optional): the time in seconds a cached GET response is reused. Defaults to 300.
+            cache_size (int, optional): the maximum number of cached responses. Defaults to 128.
         """
         self._routes: dict[str, Endpoint] = {}
         self._trailing_slash: bool = trailing_slash
 
+        # the raw content of the cached GET responses along with their retrieval time, keyed by url and header
+        self._cache: dict[tuple[str, frozenset], tuple[float, bytes]] = {}
+        self._cache_ttl, self._cache_size = cache_ttl, cache_size
+        self._cache_lock = threading.Lock()
+
+        # the workers running the asynchronous requests over the pooled connections
+        self._executor = ThreadPoolExecutor(max_workers=pool_maxsize)
+
+        if session is not None:
+            self._session: requests.Session = session
+            return
+
+        # the session shared by all the requests of this router, keeping the connections alive between the calls,
+        # only the idempotent methods being retried so that an OAuth exchange or an upload is never sent twice
+        strategy = Retry(total=retries, backoff_factor=backoff, backoff_jitter=jitter, status_forcelist=RETRY_STATUSES)
+        # blocks when the pool is exhausted rather than opening connections which would be discarded afterwards
+        adapter = HTTPAdapter(
+            max_retries=strategy, pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True
+        )
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
     def __str__(self) -> str:
         """Returns a string representation of the router.
 
@@ -181,6 +326,9 @@ class Router:
         if not isinstance(endpoint, Endpoint):
             raise ValueError("The specified endpoint is malformed")
 
+        # normalizes the trailing slash of the endpoint path once rather than on every route
+        endpoint._prefix = endpoint._prefix.rstrip("/") + ("/" if self._trailing_slash else "")
+
         self._routes[namespace] = endpoint
 
     def is_registered(self, namespace: str) -> bool:
@@ -219,41 +367,21 @@ class Router:
             str: the resulting url.
         """
         # checks if the namespace is registered
-        if namespace not in self._routes:
-            raise ValueError("The specified route is not registered")
-
-        endpoint: Endpoint = self._routes[namespace]
-        url: str = endpoint.build_url(**query)
-
-        # adds a trailing slash if the option is specified and the url does not already end with a slash
-        if self._trailing_slash and url[-1] != "/":
-            return url + "/"
+        try:
+            endpoint: Endpoint = self._routes[namespace]
+        except KeyError as error:
+            raise ValueError("The specified route is not registered") from error
 
-        # removes the trailing slash if the option is specified and the url ends with a slash
-        if not self._trailing_slash and url[-1] == "/":
-            return url[:-1]
+        return endpoint.build_url(**query)
 
-        return url
-
-    # pylint: disable=too-many-arguments
-    def __request_with_retry(
-        self,
-        method: str,
-        url: str,
-        retries: int = 3,
-        backoff: float = 0.5,
-        jitter: float = 0.5,
-        timeout: float | None = None,
-        **request,
-    ) -> requests.Response:
+    def __request_with_retry(self, method: str, url: str, timeout: float | None = None, **request) -> requests.Response:
         """Requests the specified url with the specified HTTP method and query parameters.
 
+        The failed requests are retried through the session of the router, as configured in its constructor.
+
         Args:
             method (str): the HTTP method to be used.
             url (str): the URL to be requested.
-            retries (int, optional): the number of retries. Defaults to 3.
-            backoff (float, optional): the backoff factor in seconds. Defaults to 0.5.
-            jitter (float, optional): the backoff jitter in seconds. Defaults to 0.5.
             timeout (float, optional): the request timeout in seconds. Defaults to None.
             **request: the parameters to be used for the HTTP request.
 
@@ -263,36 +391,22 @@ class Router:
         Returns:
             requests.Response: the response of the request.
         """
-        with requests.Session() as session:
-            strategy = Retry(
-                total=retries,
-                backoff_factor=backoff,
-                backoff_jitter=jitter,
-                status_forcelist=[
-                    status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    status.HTTP_502_BAD_GATEWAY,
-                    status.HTTP_503_SERVICE_UNAVAILABLE,
-                    status.HTTP_504_GATEWAY_TIMEOUT,
-                ],
+        try:
+            response = self._session.request(method, url, **request, timeout=timeout)
+            LOGGER.info(
+                "Request %s %s, respond with status %s in %.3fs",
+                method,
+                url.split("?", maxsplit=1)[0].split("/")[-1],
+                response.status_code,
+                response.elapsed.total_seconds(),
             )
-            adapter = HTTPAdapter(max_retries=strategy)
-            session.mount("http://", adapter)
-            session.mount("https://", adapter)
-
-            try:
-                response = Method[method](url, **request, timeout=timeout)
-                LOGGER.info(
-                    "Request %s %s, respond with status %s in %.3fs",
-                    method,
-                    url.split("?", maxsplit=1)[0].split("/")[-1],
-                    response.status_code,
-                    response.elapsed.total_seconds(),
-                )
-                response.raise_for_status()
-                return response
-            except requests.exceptions.RequestException as error:
-                print(error.response.text)
-                raise error
+            response.raise_for_status()
+            return response
+        except requests.exceptions.RequestException as error:
+            # the exhausted retries and the connection errors come without response
+            if error.response is not None:
+                LOGGER.error("Request %s %s failed: %s", method, url.split("?", maxsplit=1)[0], error.response.text)
+            raise
 
     # pylint: too-many-arguments
     def request(
@@ -304,6 +418,7 @@ class Router:
         files: dict[str, BufferedReader] | None = None,
         *,
         return_json: bool = True,
+        cache: bool = False,
         **params,
     ) -> requests.Response:
         """Requests the specified url with the specified HTTP method and query parameters.
@@ -315,6 +430,8 @@ class Router:
             body (str, optional): the body to be used for the HTTP request. Defaults to None.
             files (dict[str, BufferedReader], optional): the files to be used for the HTTP request. Defaults to None.
             return_json (bool, optional): flag to tell if the response is decoded to JSON. Defaults to True.
+            cache (bool, optional): if True, the JSON response of a GET request is reused for a few minutes, decoded
+                anew on each call so that the callers can modify it. Defaults to False.
             **params: the additional parameters to be used for the HTTP request.
 
         Raises:
@@ -324,29 +441,88 @@ class Router:
         Returns:
             requests.Response: the response or the JSON-encoded content if the option is specified.
         """
-        if method not in Method.__members__:
-            raise ValueError(f"Invalid method {method}, expected one of {Method.__members__.keys()}")
+        if method not in ALLOWED_METHODS:
+            raise ValueError(f"Invalid method {method}, expected one of {sorted(ALLOWED_METHODS)}")
 
         if files and body:
             raise ValueError("Cannot send both files and body in the same request")
 
-        if method in (Method.GET.name, Method.HEAD.name):
-            response = self.__request_with_retry(method, self.route(namespace, **params), headers=header)
+        url: str = self.route(namespace, **params)
+
+        # serves the GET response from the cache while it is fresh, if requested
+        key = (url, frozenset((header or {}).items())) if cache and method == "GET" and return_json else None
+        if key and (cached := self._cache.get(key)) and time.monotonic() - cached[0] < self._cache_ttl:
+            return json.loads(cached[1])
+
+        if method in ("GET", "HEAD"):
+            response = self.__request_with_retry(method, url, headers=header)
         else:
-            response = self.__request_with_retry(method, self.route(namespace, **params), headers=header, data=body)
+            response = self.__request_with_retry(method, url, headers=header, data=body)
+
+        if not return_json:
+            return response
+
+        # caches the successful responses only since the failed ones have raised already, evicting the oldest entry
+        if key and self._cache_ttl > 0:
+            with self._cache_lock:
+                self._cache[key] = (time.monotonic(), response.content)
+                if len(self._cache) > self._cache_size:
+                    del self._cache[next(iter(self._cache))]
+
+        return response.json()
+
+    def request_url(
+        self, method: str, url: str, header: dict[str, str] | None = None, body: Any = None
+    ) -> requests.Response:
+        """Requests the specified absolute url with the session of the router, the redirections not being followed.
 
-        return response.json() if return_json else response
+        It is meant for the urls given back by the APIs, such as the session uri of a resumable upload.
+
+        Args:
+            method (str): the HTTP method to be used.
+            url (str): the url to be requested.
+            header (dict[str, str], optional): the header to be used for the HTTP request. Defaults to None.
+            body (Any, optional): the body to be used for the HTTP request. Defaults to None.
+
+        Raises:
+            ValueError: if the specified method in not a valid HTTP method.
+
+        Returns:
+            requests.Response: the response of the request.
+        """
+        if method not in ALLOWED_METHODS:
+            raise ValueError(f"Invalid method {method}, expected one of {sorted(ALLOWED_METHODS)}")
+
+        return self.__request_with_retry(method, url, headers=header, data=body, allow_redirects=False)
+
+    def request_async(self, *args, **kwargs) -> Future:
+        """Requests the specified url in the background.
+
+        See:
+            :func:`~Router.request` for the parameters.
+
+        Returns:
+            Future: the future holding the response or the JSON-encoded content if the option is specified.
+        """
+        return self._executor.submit(self.request, *args, **kwargs)
 
 
 # pylint: disable=too-few-public-methods
 class Routable(ABC):
     """This class contains an object `Router` and should be extended by `Routable` classes."""
 
-    __router = Router(trailing_slash=False)
+    # the routers of the routable classes, all of them sharing the same connection pool
+    __routers: dict[type, Router] = {}
 
-    def __init__(self):
-        """Constructor for the abstract class `Routable`."""
-        routes: dict[str, str] = getattr(compyle.services.routes, self.__class__.__name__.lower().replace("api", ""))
+    def __init__(self, routes: dict[str, dict[str, Any]] | None = None):
+        """Constructor for the abstract class `Routable`.
+
+        Args:
+            routes (dict[str, dict[str, Any]], optional): the endpoints to be registered by namespace. Defaults to the
+                routes file named after the class.
+        """
+        if routes is None:
+            routes = getattr(compyle.services.routes, self.__class__.__name__.lower().replace("api", ""))
 
         for key, values in routes.items():
             self.router.register(key, Endpoint(**values))
@@ -364,16 +540,73 @@ class Routable(ABC):
         Returns:
             Router: the router for this instance.
         """
-        return self.__router
+        return self._shared_router()
 
+    @classmethod
+    def _shared_router(cls) -> Router:
+        """Returns the router of this class, created on first use over the session of the existing routers if any.
 
-def get_url_content(url: str) -> str:
-    """Retrieves the specified url and returns its content into a temporary file on disk.
+        The routes are kept apart for each class since the namespaces may collide between two APIs.
+
+        Returns:
+            Router: the router for this class.
+        """
+        if cls not in Routable.__routers:
+            shared: Router | None = next(iter(Routable.__routers.values()), None)
+            Routable.__routers[cls] = Router(trailing_slash=False, session=shared._session if shared else None)
+
+        return Routable.__routers[cls]
+
+
+def get_url_content(url: str, timeout: float | None = 30, *, persistent: bool = DEBUG) -> str:
+    """Retrieves the specified url and streams its content into a temporary file, in memory-backed storage if any.
+
+    See:
+        :func:`cleanup_url_contents` to remove the temporary files.
 
     Args:
         url (str): the url to be retrieved.
+        timeout (float, optional): the connection and read timeout in seconds. Defaults to 30.
+        persistent (bool, optional): if True, the content is kept in the cache folder under a name derived from the url
+            and reused by the next calls, which spares the network on reruns. Defaults to the debug mode.
+
+    Raises:
+        requests.exceptions.RequestException: if the download fails.
 
     Returns:
         str: the path to the newly created data file.
     """
-    return urlretrieve(url)[0]  # nosec
+    suffix: str = os.path.splitext(urlparse(url).path)[1]
+
+    if persistent:
+        folder: str = os.path.join(CACHE_FOLDER, "downloads")
+        path: str = os.path.join(folder, hashlib.sha1(url.encode(), usedforsecurity=False).hexdigest() + suffix)
+        if os.path.isfile(path):
+            return path
+        os.makedirs(folder, exist_ok=True)
+    else:
+        folder = TEMPORARY_FOLDER
+
+    with tempfile.NamedTemporaryFile(suffix=suffix, dir=folder, delete=False) as file:
+        temporary_files.append(file.name)
+        with SESSION.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                file.write(chunk)
+
+    # publishes the complete download under its persistent name, an interrupted one never being reused
+    if persistent:
+        temporary_files.remove(file.name)
+        os.replace(file.name, path)
+        return path
+
+    return file.name
+
+
+def cleanup_url_contents():
+    """Removes the temporary files created by :func:`get_url_content`."""
+    while temporary_files:
+        try:
+            os.unlink(temporary_files.pop())
+        except OSError:
+            pass
@@ -1,12 +1,31 @@
 import datetime
+import os
+import time
+from functools import lru_cache
+from operator import itemgetter
 from typing import Any
 
 from requests import HTTPError
 
 from compyle.services.common import Routable
-from compyle.settings import TWITCH_CONFIG
+from compyle.settings import CACHE_FOLDER, TWITCH_CONFIG
+from compyle.utils.descriptors import deserialize, serialize
 from compyle.utils.types import Singleton
 
+# the file persisting the game ids across runs and the time in seconds after which an entry is refreshed
+GAME_IDS_CACHE: str = os.path.join(CACHE_FOLDER, "game_ids.json")
+GAME_IDS_TTL: int = 30 * 24 * 3600
+
+
+@lru_cache(maxsize=1)
+def get_game_ids() -> dict[str, Any]:
+    """Loads the persisted game ids once per process, the returned dict being updated in place by the lookups.
+
+    Returns:
+        dict[str, Any]: the game ids along with their retrieval time by game name.
+    """
+    return deserialize(GAME_IDS_CACHE) if os.path.isfile(GAME_IDS_CACHE) else {}
+
 
 class TwitchAPI(Routable):
     """This class implements the Twitch API legacy client v5 and OAuth 2.0 for authentication.
@@ -36,6 +55,9 @@ class TwitchAPI(Routable):
         if not self.client_id or not self.client_secret:
             raise ValueError("The client id and secret must be specified in the environment variables.")
 
+        # the default request header along with the access token it was built with
+        self._default_header: tuple[str, dict[str, str]] | None = None
+
         # generates a new client access token
         self.access_token: str = self.get_new_access_token()
 
@@ -48,8 +70,13 @@ class TwitchAPI(Routable):
             **kwargs: the additional header attributes.
 
         Returns:
-            dict[str, str]: the common request header with the specified attributes.
+            dict[str, str]: the common request header with the specified attributes, shared if default.
         """
+        # reuses the default header as long as the access token is unchanged
+        default: bool = client_id and acces_token and not kwargs
+        if default and self._default_header and self._default_header[0] == self.access_token:
+            return self._default_header[1]
+
         header = {"Accept": "application/vnd.twitchtv.v5+json", **kwargs}
 
         if client_id and self.client_id:
@@ -58,6 +85,9 @@ class TwitchAPI(Routable):
         if acces_token and self.access_token:
             header["Authorization"] = f"Bearer {self.access_token}"
 
+        if default:
+            self._default_header = (self.access_token, header)
+
         return header
 
     def get_new_access_token(self) -> Any:
@@ -116,10 +146,10 @@ class TwitchAPI(Routable):
         header = self.__request_header()
         params = {"first": str(max(1, min(limit, 100)))}
 
-        return self.router.request("GET", "games", header, **params)
+        return self.router.request("GET", "games", header, cache=True, **params)
 
     def get_game_id(self, game_name: str) -> str:
-        """Returns the game id from its name.
+        """Returns the game id from its name. The ids are kept in memory and persisted on disk for 30 days.
 
         See:
             :func:`get_game` for related information.
@@ -135,7 +165,21 @@ class TwitchAPI(Routable):
         Returns:
             str: the id of the game if the response was a success.
         """
-        return self.get_game(game_name)["id"]
+        cache: dict[str, Any] = get_game_ids()
+
+        # returns the persisted id if it has not expired yet
+        entry: dict[str, Any] | None = cache.get(game_name)
+        if entry and time.time() - entry["cached_at"] < GAME_IDS_TTL:
+            return entry["id"]
+
+        game_id: str = self.get_game(game_name)["id"]
+
+        # persists the id along with its retrieval time
+        cache[game_name] = {"id": game_id, "cached_at": time.time()}
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        serialize(GAME_IDS_CACHE, cache)
+
+        return game_id
 
     def get_game(self, game_name: str) -> Any:
         """Gets the information about the game with the specified name.
@@ -157,7 +201,7 @@ class TwitchAPI(Routable):
         header = self.__request_header()
         params = {"name": game_name}
 
-        response = self.router.request("GET", "game", header, **params)
+        response = self.router.request("GET", "game", header, cache=True, **params)
         result = response["data"][0]
 
         if result["igdb_id"] != "":
@@ -180,15 +224,16 @@ class TwitchAPI(Routable):
             list[Any]: the list of clips if the response was a success.
         """
         # date format is RFC3339 like yyyy-MM-ddTHH:mm:ssZ
-        end_date = datetime.datetime.utcnow()
-        started_at = end_date - datetime.timedelta(days=max(1, period))
+        date_format = "%Y-%m-%dT%H:%M:%SZ"
+        ended_at = datetime.datetime.now(datetime.timezone.utc)
+        started_at = ended_at - datetime.timedelta(days=max(1, period))
 
         header = self.__request_header()
         params = {
             "game_id": game_id,
-            "first": str(max(1, limit)),
-            "started_at": started_at.isoformat("T") + "Z",
-            "ended_at": end_date.isoformat("T") + "Z",
+            "first": str(max(1, min(limit, 100))),
+            "started_at": started_at.strftime(date_format),
+            "ended_at": ended_at.strftime(date_format),
             "sort": "views",
         }
 
@@ -211,26 +256,37 @@ class TwitchAPI(Routable):
         min_duration = 5  # the minimum duration of the clips in seconds
         max_duration = 40  # the maximum duration of the clips in seconds
         language = "fr"  # the clip language in ISO-639-1 format as 2 digits code
-        whitelist = []  # the list of broadcaster ids whose clips are included regardless of the other criteria
-        blacklist = []  # the list of broadcaster ids whose clips are ignored
+        whitelist = set()  # the set of broadcaster ids whose clips are included regardless of the other criteria
+        blacklist = set()  # the set of broadcaster ids whose clips are ignored
 
         clips = []
-        for _ in range(max(1, pages)):
-            response = self.router.request("GET", "clips", header, **params)
+        # the offsets and durations of the clips kept so far, grouped by the video they are from
+        vods: dict[str, list[tuple[int, int]]] = {}
+        pending = self.router.request_async("GET", "clips", header, cache=True, **params)
+        for page in range(max(1, pages)):
+            response = pending.result()
 
             if not response["data"] or not response["pagination"]["cursor"]:
                 break
 
+            # requests the next page while the current one is being parsed
+            params["after"] = response["pagination"]["cursor"]
+            pending = None
+            if page + 1 < pages:
+                pending = self.router.request_async("GET", "clips", header, cache=True, **params)
+
             # parses the clips and filters them with the specified criteria
             for clip in response["data"]:
                 # skips the clip if the broadcaster is in the blacklist
                 # if clip["broadcaster_id"] in blacklist:
                 #     continue
 
-                # stops the parsing if the clips have too low view_count of clips is reached
+                # stops the parsing if the clips have too low view_count, the next ones being sorted by views
                 if clip["view_count"] < min_views:
                     break
 
+                duration, vod_offset = clip["duration"], clip["vod_offset"]
+
                 if (
                     # checks if the broadcaster is in the whitelist
                     # clip["broadcaster_id"] in whitelist
@@ -240,14 +296,13 @@ class TwitchAPI(Routable):
                     # checks if the clip language is the specified one, if any specified all languages are valid
                     clip["language"] == language
                     # checks if the clip duration is between the specified bounds
-                    and min_duration <= clip["duration"] <= max_duration
+                    and min_duration <= duration <= max_duration
                 ):
                     # checks if the video the clip is from is not already in the list from the vod_offset
-                    if not any(
-                        clip["video_id"] == c["video_id"]
-                        and abs(clip["vod_offset"] - c["vod_offset"]) <= max(clip["duration"], c["duration"])
-                        for c in clips
-                    ):
+                    vod: list[tuple[int, int]] = vods.setdefault(clip["video_id"], [])
+                    if not any(abs(vod_offset - offset) <= max(duration, length) for offset, length in vod):
+                        vod.append((vod_offset, duration))
+
                         # adds new attributes to the clip
                         clip["clip_url"] = self.get_clip_url(clip)
                         clip["broadcaster_url"] = self.get_broadcaster_url(clip["broadcaster_name"])
@@ -258,16 +313,16 @@ class TwitchAPI(Routable):
                         # stops the parsing if enough clips were found
                         if max_clips and len(clips) == max_clips:
                             break
+            else:
+                continue
 
-            params["after"] = response["pagination"].get("cursor")
-            if params["after"] is None:
-                break
+            # drops the next page since the parsing stopped before the end of this one
+            if pending:
+                pending.cancel()
+            break
 
-        # sorts the clips by view count and creation date
-        clips.sort(
-            key=lambda clip: (clip["view_count"], datetime.datetime.strptime(clip["created_at"], "%Y-%m-%dT%H:%M:%SZ")),
-            reverse=True,
-        )
+        # sorts the clips by view count and creation date, the RFC3339 dates being ordered lexicographically
+        clips.sort(key=itemgetter("view_count", "created_at"), reverse=True)
 
         return clips
 
@@ -287,10 +342,7 @@ class TwitchAPI(Routable):
             str: the URL of the clip.
         """
         # removes the suffix '-preview-480x272.jpg' from the thumbnail url
-        thumbnai_url: str = clip["thumbnail_url"]
-        index = thumbnai_url.index("-preview-")
-
-        return thumbnai_url[:index] + ".mp4"
+        return clip["thumbnail_url"].partition("-preview-")[0] + ".mp4"
 
     def get_clip(self, clip_id: str) -> Any:
         """Returns the clip with the specified id.
@@ -1,19 +1,29 @@
 import json
 import os
-import sys
+import time
 import webbrowser
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any
 from urllib.parse import parse_qs, urlparse
 
 import requests
-from requests import HTTPError
 from requests_toolbelt import MultipartEncoder
 
 from compyle.services.common import Routable
 from compyle.settings import YOUTUBE_CONFIG
 from compyle.utils.types import Singleton
 
+# the time in seconds during which the categories of a region are reused, and the categories fetched so far by region
+# along with their retrieval time and their entity tag
+CATEGORIES_TTL: int = 3 * 24 * 3600
+categories_cache: dict[str, tuple[float, str | None, list[Any]]] = {}
+
+# the size in bytes of the uploaded chunks as a multiple of 256 KiB, and the status of a partially uploaded video
+UPLOAD_CHUNK_SIZE: int = 8 * 1024 * 1024
+UPLOAD_INCOMPLETE: int = 308
+
 
 class PrivacyStatus(Enum):
     """Represents the upload privacy status for a video."""
@@ -198,6 +208,38 @@ class YoutubeAPI(Routable):
 
         return header
 
+    def __get_category_items(self, region_code: str) -> list[Any]:
+        """Retrieves the categories in the specified region, reused for 3 days and then revalidated with their ETag.
+
+        Args:
+            region_code (str): the code of the region.
+
+        Returns:
+            list[Any]: the category resources of the region.
+        """
+        # returns the categories fetched recently for this region if any
+        cached: tuple[float, str | None, list[Any]] | None = categories_cache.get(region_code)
+        if cached and time.monotonic() - cached[0] < CATEGORIES_TTL:
+            return cached[2]
+
+        header = self.__request_header()
+        params = {"part": "snippet", "regionCode": region_code}
+
+        # revalidates the expired categories, the server answering without body if they did not change
+        if cached and cached[1]:
+            header["If-None-Match"] = cached[1]
+
+        response = self.router.request("GET", "categories", header, return_json=False, **params)
+        if cached and response.status_code == requests.codes.not_modified:
+            items: list[Any] = cached[2]
+        else:
+            items = response.json()["items"]
+
+        etag: str | None = response.headers.get("ETag") or (cached[1] if cached else None)
+        categories_cache[region_code] = (time.monotonic(), etag, items)
+
+        return items
+
     def get_categories(self, region_code: str = "FR") -> list[tuple[str, int]]:
         """Retrieves the list of categories in the region specified by the region_code in the format ISO 3166-1 alpha-2.
 
@@ -211,34 +253,44 @@ class YoutubeAPI(Routable):
         Returns:
             list[tuple[str, int]]: the list of assignable categories in the specified region.
         """
-        header = self.__request_header()
-        params = {"part": "snippet", "regionCode": region_code}
-
-        response = self.router.request("GET", "categories", header, **params)
+        items: list[Any] = self.__get_category_items(region_code)
 
-        return [(c["snippet"]["title"], c["id"]) for c in response["items"] if c["snippet"]["assignable"]]
+        return [(c["snippet"]["title"], c["id"]) for c in items if c["snippet"]["assignable"]]
 
-    def is_category(self, category: str = "22") -> bool:
+    def is_category(self, category: str = "22", region_code: str = "FR") -> bool:
         """Tells if the specified category exists.
 
         Args:
             category (str, optional): the category id. Defaults to "22".
+            region_code (str, optional): the code of the region the category is looked up in. Defaults to "FR".
 
         Returns:
-            bool: True if the category exists, False in case videoCategoryNotFound is raised.
+            bool: True if the category exists among the categories of the region, False otherwise.
         """
-        header = self.__request_header()
-        params = {"part": "snippet", "id": category}
+        return self.are_categories([category], region_code)[category]
+
+    def are_categories(self, categories: list[str], region_code: str = "FR") -> dict[str, bool]:
+        """Tells for each of the specified categories if it exists, all of them being looked up with a single request.
+
+        Args:
+            categories (list[str]): the category ids.
+            region_code (str, optional): the code of the region the categories are looked up in. Defaults to "FR".
+
+        Returns:
+            dict[str, bool]: the existence of each category by id.
+        """
+        ids: set[str] = {c["id"] for c in self.__get_category_items(region_code)}
 
-        try:
-            self.router.request("GET", "categories", header, return_json=False, **params)
-        except HTTPError:
-            return False
-        return True
+        return {category: category in ids for category in categories}
 
     # pylint: disable=too-many-arguments
-    def upload_video(self, filename: str, title: str, description: str, category: str, tags: list[str] | None = None):
-        """Uploads a video to Youtube from the specified file.
+    def upload_video(
+        self, filename: str, title: str, description: str, category: str, tags: list[str] | None = None
+    ) -> Any:
+        """Uploads a video to Youtube from the specified file following the resumable upload protocol.
+
+        The file is streamed in chunks through a single reused buffer, the upload resuming from the last byte received
+        by the server after each chunk.
 
         See:
             https://developers.google.com/youtube/v3/guides/uploading_a_video?hl=en for the upload process.
@@ -251,54 +303,74 @@ class YoutubeAPI(Routable):
             description (str): the description of the video.
             category (str): the category id of the video as a string.
             tags (list[str], optional): the tags of the video. Defaults to None.
+
+        Returns:
+            Any: the uploaded video resource.
         """
-        with open(filename, "rb") as file:
-            body = {
-                "snippet": {
-                    "title": title,
-                    "description": description,
-                    "tags": tags or [],
-                    "categoryId": category,
-                    # "thumbnails": {
-                    #     "default": {"url": "https://i.ytimg.com/vi/3jWRrafhO7M/default.jpg", "width": 120, "height": 90}
-                    # },
-                },
-                "status": {
-                    "privacyStatus": PrivacyStatus.PRIVATE.value,
-                    "embeddable": True,
-                },
-            }
+        body = {
+            "snippet": {
+                "title": title,
+                "description": description,
+                "tags": tags or [],
+                "categoryId": category,
+                # "thumbnails": {
+                #     "default": {"url": "https://i.ytimg.com/vi/3jWRrafhO7M/default.jpg", "width": 120, "height": 90}
+                # },
+            },
+            "status": {
+                "privacyStatus": PrivacyStatus.PRIVATE.value,
+                "embeddable": True,
+            },
+        }
 
-            print("body:", body)
+        with open(filename, "rb") as file:
+            size: int = os.fstat(file.fileno()).st_size
 
             header = self.__request_header()
-            header["Content-Length"] = str(sys.getsizeof(body))  # the number of bytes provided in the request body
-            header["Content-Type"] = "application/json; charset=UTF-8"  # the MIME type of the body of the request
-            header["X-Upload-Content-Length"] = str(os.fstat(file.fileno()).st_size)  # the size of the video in bytes
+            header["X-Upload-Content-Length"] = str(size)  # the size of the video in bytes
             header["X-Upload-Content-Type"] = "video/mp4"  # the MIME type of the video
 
-            print("header", header)
-
             params = {"part": "snippet,status,contentDetails", "uploadType": "resumable"}
 
-            # TODO add body to request
-
-            response = self.router.request("POST", "resumable_upload", header, body, return_json=False, **params)
+            # starts the upload session with the video metadata
+            response = self.router.request(
+                "POST", "resumable_upload", header, json.dumps(body), return_json=False, **params
+            )
             session_uri: str = response.headers["Location"]
 
-            header["Content-Type"] = header.pop("X-Upload-Content-Type")
-            header["Content-Length"] = header.pop("X-Upload-Content-Length")
+            # streams the video chunk by chunk into the same buffer
+            buffer = memoryview(bytearray(UPLOAD_CHUNK_SIZE))
+            offset: int = 0
+            while True:
+                file.seek(offset)
+                length: int = file.readinto(buffer)
+                header = {"Content-Type": "video/mp4", "Content-Range": f"bytes {offset}-{offset + length - 1}/{size}"}
 
-            files = {"file": file}
+                response = self.router.request_url("PUT", session_uri, header, buffer[:length])
+                if response.status_code != UPLOAD_INCOMPLETE:
+                    return response.json()
 
-            print(session_uri)
-            exit(0)
+                # resumes after the last byte received, the range being like 'bytes=0-524287' if any
+                received: str | None = response.headers.get("Range")
+                offset = int(received.rpartition("-")[2]) + 1 if received else 0
 
-            # response = self.router.request("PUT", session_uri, header, files=files, **body)
+    def upload_videos(self, videos: list[dict[str, Any]], concurrency: int = 4) -> list[Any]:
+        """Uploads the specified videos concurrently, a failed upload not interrupting the others.
 
-        print(header, params, body)
+        See:
+            :func:`upload_video` for the arguments of each video.
+
+        Args:
+            videos (list[dict[str, Any]]): the keyword arguments of each upload.
+            concurrency (int, optional): the maximum number of simultaneous uploads. Defaults to 4.
+
+        Returns:
+            list[Any]: the uploaded video resources in order, or the raised exception in place of a failed upload.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures: list[Future] = [executor.submit(self.upload_video, **video) for video in videos]
 
-        exit(0)
+        return [future.exception() or future.result() for future in futures]
 
     def test(self, filename: str, title: str, description: str, category: str, tags: list[str] | None = None):
         params = {"part": "snippet,status", "uploadType": "multipart", "notifySubscribers": True}
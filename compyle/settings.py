@@ -1,5 +1,5 @@
 from collections import namedtuple
-from os import getenv
+from os import getenv, path
 from typing import Final
 
 from dotenv import load_dotenv
@@ -8,6 +8,9 @@ load_dotenv()
 
 DEBUG: Final = getenv("DEBUG") in ["True", "true"]
 
+# the folder where to persist the data cached across runs
+CACHE_FOLDER: Final = getenv("CACHE_FOLDER", path.join(path.expanduser("~"), ".cache", "compyle"))
+
 # environment variables for the youtube service
 YOUTUBE_CONFIG = namedtuple("YOUTUBE_APP_CONFIG", ["client_id", "client_secret", "redirect_uri", "client_email"])(
     getenv("YOUTUBE_APP_CLIENT_ID"),
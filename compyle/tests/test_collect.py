@@ -5,7 +5,11 @@ import sys
 from typing import Any, Dict, Sequence
 from unittest import TestCase, main, mock, skip
 
+from pymongo.write_concern import WriteConcern
+
 from compyle.actions import collect
+from compyle.databases.mongo import MongoDB
+from compyle.services.common import Endpoint
 
 
 class TestParser(TestCase):
@@ -117,6 +121,12 @@ class TestCollect(TestParser):
             "the output argument should be equal to the normalized path",
         )
 
+    def test_parser_fast_flag(self):
+        self.assertFalse(self.get_vars(["-out", self.output_files[0]])["fast"], "the fast flag should default to False")
+        self.assertTrue(
+            self.get_vars(["-out", self.output_files[0], "--fast"])["fast"], "the fast flag should be set when provided"
+        )
+
     @skip("TODO: mock the twitch api")
     @mock.patch("compyle.services.databases.mongo.MongoDB")
     @mock.patch("compyle.services.controllers.twitch.TwitchAPI")
@@ -129,5 +139,63 @@ class TestCollect(TestParser):
         kwargs.pop("func")(**kwargs)
 
 
+class TestInsertDocuments(TestCase):
+    def setUp(self):
+        # builds the client without connecting to the database
+        self.mongo_db = object.__new__(MongoDB)
+        self.mongo_db.database = mock.MagicMock()
+
+        collection: mock.MagicMock = self.mongo_db.database.__getitem__.return_value
+        for target in (collection, collection.with_options.return_value):
+            target.insert_many.side_effect = lambda batch, **kwargs: mock.Mock(
+                inserted_ids=[document["id"] for document in batch]
+            )
+        self.collection = collection
+
+    def test_insert_documents_fast(self):
+        documents = [{"id": i} for i in range(5)]
+        result = self.mongo_db.insert_documents("clips", documents, fast=True, batch_size=2)
+
+        self.collection.with_options.assert_called_once_with(write_concern=WriteConcern(w=0))
+        target: mock.MagicMock = self.collection.with_options.return_value
+        self.assertEqual(target.insert_many.call_count, 3, "the documents should be sent in batches of 2")
+        for call in target.insert_many.call_args_list:
+            self.assertNotIn(
+                "bypass_document_validation",
+                call.kwargs,
+                "the document validation cannot be bypassed with an unacknowledged write concern",
+            )
+        self.assertEqual(result.inserted_ids, list(range(5)), "the ids of every batch should be collected")
+        self.assertFalse(result.acknowledged, "the fast insertion should not be acknowledged")
+
+    def test_insert_documents_acknowledged(self):
+        documents = [{"id": i} for i in range(3)]
+        result = self.mongo_db.insert_documents("clips", documents)
+
+        self.collection.with_options.assert_not_called()
+        self.collection.insert_many.assert_called_once()
+        self.assertTrue(result.acknowledged, "the default insertion should be acknowledged")
+        self.assertIn("updated_at", documents[0], "the documents should be timestamped")
+
+
+class TestEndpoint(TestCase):
+    def setUp(self):
+        self.endpoint = Endpoint("https://api.twitch.tv/helix", "/clips", req=["id"], opt=["first", "after"])
+        Endpoint._encode_url.cache_clear()
+
+    def test_build_url_repeated_params(self):
+        url: str = self.endpoint.build_url(id=["1", "2"], first=20)
+        self.assertEqual(url, "https://api.twitch.tv/helix/clips?first=20&id=1&id=2", "the list should be repeated")
+
+    def test_build_url_cursor_not_cached(self):
+        for cursor in ("abc", "def", "ghi"):
+            url: str = self.endpoint.build_url(id="1", after=cursor)
+            self.assertEqual(url, f"https://api.twitch.tv/helix/clips?id=1&after={cursor}")
+
+        cache_info = Endpoint._encode_url.cache_info()
+        self.assertEqual(cache_info.currsize, 1, "the cursor should not be part of the cached url")
+        self.assertEqual(cache_info.hits, 2, "the pages should share the cached url")
+
+
 if __name__ == "__main__":
     main()
@@ -1,10 +1,10 @@
 import os
 import sys
 import uuid
-from typing import Any, Dict, Iterable, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 from unittest import TestCase, main
 
-from compyle.actions.edit import dfs, ne
+from compyle.actions.edit import rearrange, separate
 
 
 class TestParser(TestCase):
@@ -24,32 +24,14 @@ class TestParser(TestCase):
         sys.stderr = self.original_stderr
 
 
-class TestNe(TestCase):
-    def is_commutative(
-        self, data: Iterable[Union[Any, Dict[str, Any]]], i: int, j: int, key: Optional[str] = None
-    ) -> bool:
-        return ne(data, key, i, j) and ne(data, key, j, i)
+class TestRearrange(TestCase):
+    def is_sorted(self, data: List[Union[Any, Dict[str, Any]]], key: Optional[str] = None) -> bool:
+        values = [e[key] for e in data] if key else data
+        return all(values[i] != values[i + 1] for i in range(len(values) - 1))
 
-    def is_valid(self, data: Iterable[Any], i: int, j: int, key: str = uuid.uuid1()) -> bool:
-        return self.is_commutative([{key: e} for e in data], i, j, key) and self.is_commutative(data, i, j)
-
-    def test_returns_false_i_equal_j(self):
-        self.assertFalse(self.is_valid([1], 0, 0))
-
-    def test_returns_false_for_equal_values(self):
-        self.assertFalse(self.is_valid([1, 1], 0, 1))
-
-    def test_returns_true_for_unequal_values(self):
-        self.assertTrue(self.is_valid([1, 2], 0, 1))
-
-
-class TestBfs(TestCase):
-    def is_sorted(self, data: Iterable[Union[Any, Dict[str, Any]]], key: Optional[str] = None) -> bool:
-        return all(ne(data, key, i, i + 1) for i in range(len(data) - 1))
-
-    def is_valid(self, data: Iterable[Any], key: str = uuid.uuid1(), start: int = 0) -> bool:
+    def is_valid(self, data: List[Any], key: str = str(uuid.uuid1())) -> bool:
         scd = [{key: e} for e in data]
-        return dfs(scd, key, start) and self.is_sorted(scd, key) and dfs(data, i=start) and self.is_sorted(data)
+        return rearrange(scd, key) and self.is_sorted(scd, key) and rearrange(data) and self.is_sorted(data)
 
     def test_returns_true_for_empty_list(self):
         self.assertTrue(self.is_valid([]))
@@ -60,14 +42,56 @@ class TestBfs(TestCase):
     def test_returns_true_for_unsorted_list(self):
         self.assertTrue(self.is_valid([1, 3, 2]))
 
+    def test_returns_true_for_alternating_majority(self):
+        self.assertTrue(self.is_valid([6, 6, 6, 6, 1, 1, 1, 1, 1, 6, 6]))
+
     def test_returns_false_for_impossible_sort(self):
         self.assertFalse(self.is_valid([1, 2, 2, 2]))
 
+    def test_returns_false_for_majority_behind_first_element(self):
+        self.assertFalse(self.is_valid([1, 1, 1, 1, 1, 6, 6, 6, 6, 6, 6]))
+
     def test_does_not_affect_data_for_impossible_sort(self, data=[1, 2, 2, 2]):
         self.assertFalse(self.is_valid(data) or data != [1, 2, 2, 2])
 
     def test_keeps_the_first_element_in_first_place(self, data=[1, 1, 2, 3]):
-        self.assertTrue(self.is_valid(data, start=1) and data[0] == 1)
+        self.assertTrue(self.is_valid(data) and data[0] == 1)
+
+    def test_keeps_the_relative_order_of_equal_elements(self):
+        data = [{"name": "a", "rank": 0}, {"name": "a", "rank": 1}, {"name": "b", "rank": 2}, {"name": "a", "rank": 3}]
+        data += [{"name": "c", "rank": 4}]
+
+        self.assertTrue(rearrange(data, "name"))
+        self.assertEqual([e["rank"] for e in data if e["name"] == "a"], [0, 1, 3])
+
+    def test_handles_large_skewed_list(self):
+        self.assertTrue(self.is_valid([0] + [1] * 5000 + [i % 7 + 2 for i in range(5000)]))
+
+    def test_keeps_the_data_sorted_when_already_arranged(self, data=[1, 2, 1, 2, 1]):
+        self.assertTrue(self.is_valid(data) and data == [1, 2, 1, 2, 1])
+
+
+class TestSeparate(TestCase):
+    def test_returns_zero_for_empty_list(self):
+        self.assertEqual(separate([]), 0)
+
+    def test_interleaves_the_majority_behind_first_element(self, data=[1, 1, 1, 1, 1, 6, 6, 6, 6, 6, 6]):
+        self.assertEqual(separate(data), 1)
+        self.assertEqual(data, [1, 6, 1, 6, 1, 6, 1, 6, 1, 6, 6])
+
+    def test_keeps_the_first_element_in_first_place(self, data=[1, 2, 2, 2]):
+        self.assertEqual(separate(data), 2)
+        self.assertEqual(data, [1, 2, 2, 2])
+
+    def test_leads_with_the_dominant_first_element(self, data=[0, 0, 0, 2, 0, 1]):
+        self.assertEqual(separate(data), 1)
+        self.assertEqual(data, [0, 2, 0, 1, 0, 0])
+
+    def test_separates_dictionaries_by_key(self):
+        data = [{"name": "a", "rank": i} for i in range(4)] + [{"name": "b", "rank": 4}]
+
+        self.assertEqual(separate(data, "name"), 2)
+        self.assertEqual([e["rank"] for e in data], [0, 4, 1, 2, 3])
 
 
 if __name__ == "__main__":
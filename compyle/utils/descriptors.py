@@ -1,5 +1,11 @@
 import json
-from typing import Any, Dict
+import os
+from typing import Any, Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 
 def deserialize(path: str) -> Any:
@@ -18,10 +24,42 @@ def deserialize(path: str) -> Any:
 def serialize(path: str, _object: Dict[str, Any] = None):
     """Saves the JSON object to the specified file replacing its content.
 
+    The object is encoded with orjson when available, falling back to the standard json module otherwise,
+    and the resulting indented bytes are written to the file in a single call.
+
     Params:
         path (str): the location where to store the JSON object.
         _object (Dict[str, Any]): the JSON object to be saved.
     """
     if path and _object:
-        with open(path, "w", encoding="utf-8") as file:
-            json.dump(_object, file, indent=4)
+        buffer: bytes
+        if orjson:
+            buffer = orjson.dumps(
+                _object, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC
+            )
+        else:
+            buffer = json.dumps(_object, indent=2).encode("utf-8")
+
+        with open(path, "wb") as file:
+            file.write(buffer)
+
+
+def get_latest_file(path: os.PathLike) -> Optional[str]:
+    """Returns the most recent file that has been created in the specified folder path.
+
+    Params:
+        path (os.PathLike): the path to the directory.
+
+    Returns:
+        Optional[str]: the path to the most recent file if any, otherwise None.
+    """
+    # checks if the specified path is an existing directory
+    if path and os.path.isdir(path):
+        # gets the file with the latest creation time, each entry being stat'ed once along with the directory listing
+        with os.scandir(path) as entries:
+            latest = max(
+                ((entry.stat().st_ctime, entry.path) for entry in entries if entry.is_file()),
+                default=None,
+            )
+        return latest[1] if latest else None
+    return None